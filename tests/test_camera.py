@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import socket
+
+import pytest
+
+from vrcar.common import Frame
+from vrcar.server.camera import CameraClient
+
+
+@pytest.fixture
+def client():
+    server, peer = socket.socketpair()
+    client = CameraClient(server, ("127.0.0.1", 0), 2)
+    yield client
+    server.close()
+    peer.close()
+
+
+def _frame(sequence: int, keyframe: bool) -> Frame:
+    return Frame(memoryview(b"frame"), sequence, keyframe, 0.0)
+
+
+def _queued(client: CameraClient) -> list[int]:
+    sequences = []
+    while not client._queue.empty():
+        sequences.append(client._queue.get_nowait().sequence)
+    return sequences
+
+
+def test_starts_with_keyframe(client):
+    client.put(_frame(1, keyframe=False))
+    client.put(_frame(2, keyframe=False))
+    client.put(_frame(3, keyframe=True))
+    client.put(_frame(4, keyframe=False))
+
+    assert client.dropped == 2
+    assert not client.resync
+    assert _queued(client) == [3, 4]
+
+
+def test_full_queue_drops_until_keyframe(client):
+    client.put(_frame(1, keyframe=True))
+    client.put(_frame(2, keyframe=False))
+    # the queue is full, so this frame and all up to the next keyframe are lost
+    client.put(_frame(3, keyframe=False))
+    assert client.resync
+    client.put(_frame(4, keyframe=False))
+
+    assert client.dropped == 2
+    assert _queued(client) == [1, 2]
+
+
+def test_keyframe_replaces_queue(client):
+    client.put(_frame(1, keyframe=True))
+    client.put(_frame(2, keyframe=False))
+    client.put(_frame(3, keyframe=True))
+
+    # the keyframe makes room by dropping the oldest queued frames
+    assert client.dropped == 1
+    assert not client.resync
+    assert _queued(client) == [2, 3]
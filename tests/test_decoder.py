@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import io
+import threading
+import time
+
+import pytest
+
+from vrcar.client import latency
+from vrcar.client.camera import BufferPool
+from vrcar.client.decoder import Decoder
+from vrcar.common import CAM_HEIGHT, CAM_WIDTH
+
+SIZE = (CAM_WIDTH, CAM_HEIGHT)
+
+
+class Provider:
+    def __init__(self):
+        self.frames: list[tuple[bytes, tuple[int, int]]] = []
+        self.timings: list[latency.FrameTiming] = []
+        self.drawn = threading.Event()
+
+    def draw(self, frame, size, timing):
+        self.frames.append((bytes(frame), size))
+        self.timings.append(timing)
+        self.drawn.set()
+
+    def center(self, index: int = -1) -> tuple[int, ...]:
+        frame, (width, height) = self.frames[index]
+        offset = (height // 2 * width + width // 2) * 3
+        return tuple(frame[offset : offset + 3])
+
+
+def _submit(
+    decoder: Decoder, pool: BufferPool, data: bytes, sequence: int = 0
+) -> latency.FrameTiming:
+    buffer = pool.acquire(len(data))
+    buffer[: len(data)] = data
+    now = time.time()
+    timing = latency.stats.frame(sequence, now, now, now)
+    decoder.submit(buffer, len(data), timing)
+    return timing
+
+
+def _wait(decoder: Decoder, count: int):
+    assert decoder.wait_finished(count, 10), "decoder did not finish"
+
+
+def _jpeg(color: tuple[int, int, int], size: tuple[int, int] = SIZE) -> bytes:
+    Image = pytest.importorskip("PIL.Image")
+
+    with io.BytesIO() as file:
+        Image.new("RGB", size, color).save(file, "JPEG", quality=95)
+        return file.getvalue()
+
+
+def _h264(frames: int, size: tuple[int, int] = SIZE) -> list[bytes]:
+    av = pytest.importorskip("av")
+
+    codec = av.CodecContext.create("libx264", "w")
+    codec.width, codec.height = size
+    codec.pix_fmt = "yuv420p"
+    codec.options = {"tune": "zerolatency", "bframes": "0", "g": "5"}
+
+    packets = []
+    for index in range(frames):
+        # uniformly gray, with the frame index as value
+        image = av.VideoFrame(*size, "rgb24")
+        image.planes[0].update(bytes([index * 10]) * (size[0] * size[1] * 3))
+        packets.extend(bytes(packet) for packet in codec.encode(image))
+    packets.extend(bytes(packet) for packet in codec.encode(None))
+
+    return packets
+
+
+def _assert_close(pixel: tuple[int, ...], expected: tuple[int, ...]):
+    assert all(abs(a - b) <= 3 for a, b in zip(pixel, expected)), pixel
+
+
+def test_jpeg_decodes_to_rgb():
+    data = _jpeg((200, 40, 90))
+    provider = Provider()
+    pool = BufferPool(3)
+    decoder = Decoder([provider], pool)
+    decoder.start()
+
+    _submit(decoder, pool, data)
+    _wait(decoder, 1)
+
+    assert provider.drawn.wait(1)
+    assert decoder.decoded == 1
+    assert decoder.failed == 0
+    frame, size = provider.frames[0]
+    assert size == SIZE
+    assert len(frame) == SIZE[0] * SIZE[1] * 3
+    _assert_close(provider.center(), (200, 40, 90))
+
+
+@pytest.mark.parametrize("codec", ["jpeg", "h264"])
+def test_keeps_frame_size(codec):
+    size = (640, 480)
+    packets = [_jpeg((0, 0, 0), size)] if codec == "jpeg" else _h264(2, size)
+    provider = Provider()
+    pool = BufferPool(len(packets))
+    decoder = Decoder([provider], pool)
+    decoder.start()
+
+    for packet in packets:
+        _submit(decoder, pool, packet)
+    _wait(decoder, len(packets))
+
+    # lower presets are scaled up by the providers, not while decoding
+    assert provider.drawn.wait(1)
+    frame, drawn_size = provider.frames[-1]
+    assert drawn_size == size
+    assert len(frame) == size[0] * size[1] * 3
+
+
+def test_jpeg_only_decodes_newest():
+    provider = Provider()
+    pool = BufferPool(3)
+    decoder = Decoder([provider], pool)
+
+    # queued before the decoder runs, so the first two are superseded
+    for sequence, value in enumerate((10, 120, 240)):
+        timing = _submit(decoder, pool, _jpeg((value, value, value)), sequence)
+    decoder.start()
+    _wait(decoder, 3)
+
+    assert provider.drawn.wait(1)
+    assert decoder.skipped == 2
+    assert decoder.decoded == 1
+    assert len(provider.frames) == 1
+    assert provider.timings == [timing]
+    _assert_close(provider.center(), (240, 240, 240))
+    # skipped buffers went back to the pool
+    for _ in range(3):
+        pool.acquire(0)
+
+
+def test_h264_decodes_every_frame():
+    frames = 12
+    packets = _h264(frames)
+    provider = Provider()
+    pool = BufferPool(len(packets))
+    decoder = Decoder([provider], pool)
+
+    for packet in packets:
+        _submit(decoder, pool, packet)
+    decoder.start()
+    _wait(decoder, len(packets))
+
+    assert provider.drawn.wait(1)
+    # inter frames depend on each other, so none may be skipped
+    assert decoder.skipped == 0
+    assert decoder.failed == 0
+    assert decoder.decoded == len(packets)
+    frame, size = provider.frames[-1]
+    assert size == SIZE
+    assert len(frame) == SIZE[0] * SIZE[1] * 3
+    value = (frames - 1) * 10
+    _assert_close(provider.center(), (value, value, value))
+
+
+def test_invalid_frame_counts_as_failed():
+    provider = Provider()
+    pool = BufferPool(3)
+    decoder = Decoder([provider], pool)
+    decoder.start()
+
+    _submit(decoder, pool, b"\xff\xd8 not a JPEG")
+    _wait(decoder, 1)
+
+    assert decoder.failed == 1
+    assert not provider.frames
+
+
+def test_display_recorded_once():
+    stats = latency.LatencyStats()
+    timing = stats.frame(1, time.time() - 0.05, time.time(), time.time())
+    stats.decoded(timing)
+
+    # every provider presenting the frame reports it
+    stats.displayed(timing)
+    stats.displayed(timing)
+    stats.displayed(None)
+
+    assert timing.displayed
+    assert stats.total["display"].count == 1
+    assert stats.total["total"].count == 1
@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+import logging
+import os
+import time
+
+from vrcar.log import SessionFileHandler, cleanup
+
+DAY = 24 * 60 * 60
+
+
+def _touch(path, age: float = 0):
+    path.write_text("")
+    modified = time.time() - age
+    os.utime(path, (modified, modified))
+
+
+def test_cleanup_groups_sessions(tmp_path):
+    _touch(tmp_path / "2024-01-01_00-00-00.log", 3 * DAY)
+    _touch(tmp_path / "2024-01-01_00-00-00.log.1", 3 * DAY)
+    _touch(tmp_path / "latency_2024-01-01_01-00-00.json", 3 * DAY)
+    _touch(tmp_path / "2024-01-02_00-00-00.log", DAY)
+    # a recent part keeps the whole session
+    _touch(tmp_path / "2024-01-03_00-00-00.log", 3 * DAY)
+    _touch(tmp_path / "2024-01-03_00-00-00.log.1")
+
+    cleanup(tmp_path, 10, 2 * DAY)
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "2024-01-02_00-00-00.log",
+        "2024-01-03_00-00-00.log",
+        "2024-01-03_00-00-00.log.1",
+    ]
+
+
+def test_rollover_after_interval_cleans_up(tmp_path):
+    _touch(tmp_path / "2024-01-01_00-00-00.log", 3 * DAY)
+    current = tmp_path / "2024-01-05_00-00-00.log"
+    handler = SessionFileHandler(str(current), 1024 * 1024, 2, 0.5, 10, 2 * DAY)
+    record = logging.LogRecord("test", logging.INFO, __file__, 0, "x", None, None)
+
+    handler.emit(record)
+    time.sleep(0.6)
+    handler.emit(record)
+    handler.close()
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "2024-01-05_00-00-00.log",
+        "2024-01-05_00-00-00.log.1",
+    ]
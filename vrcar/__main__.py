@@ -32,11 +32,182 @@ def parse_args():
         default=23_456,
         help="the controls port (default: %(default)s)",
     )
+    parser.add_argument(
+        "--udp-controls",
+        action="store_true",
+        help="receive controls over UDP instead of TCP",
+    )
+    parser.add_argument(
+        "--codec",
+        choices=["mjpeg", "h264"],
+        default="mjpeg",
+        help="the camera stream codec (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--adaptive-quality",
+        action="store_true",
+        help="adjust camera quality based on client feedback",
+    )
+    parser.add_argument(
+        "--failsafe-timeout",
+        metavar="MS",
+        type=int,
+        default=500,
+        help="stop the motors if no UDP controls arrive in time (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--actuator-rate",
+        metavar="HZ",
+        type=float,
+        default=100,
+        help="the rate of motor and servo updates (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--servo-slew",
+        metavar="DEG/S",
+        type=float,
+        default=300,
+        help="the maximum servo speed, 0 for no limit (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--motor-config",
+        metavar="FILE",
+        help="a JSON file with the wheel mixing matrix, trims and response curve",
+    )
+    parser.add_argument(
+        "--record",
+        metavar="FILE",
+        help="record received controls and motor outputs to FILE for replay",
+    )
+    parser.add_argument(
+        "--record-video",
+        metavar="FILE",
+        help="record the served camera frames to FILE and an index to FILE.idx",
+    )
+    parser.add_argument(
+        "--size",
+        metavar="WxH",
+        type=parse_size,
+        help="override the camera resolution of the quality preset",
+    )
+    parser.add_argument(
+        "--framerate",
+        metavar="FPS",
+        type=int,
+        help="override the camera frame rate of the quality preset",
+    )
+    parser.add_argument(
+        "--warm-camera",
+        action="store_true",
+        help="start the camera at boot instead of with the first client",
+    )
+    parser.add_argument(
+        "--simulate",
+        action="store_true",
+        help="run without hardware, using synthetic frames and a virtual PWM chip",
+    )
+    parser.add_argument(
+        "--simulate-bitrate",
+        metavar="MBIT",
+        type=float,
+        default=0,
+        help="pad synthetic frames to reach this bitrate in Mbit/s",
+    )
 
     parser = parsers.add_parser(
         "client",
         help="run the vrcar pygame demo client",
     )
+    parser.add_argument(
+        "address",
+        nargs="?",
+        help="the address to connect to",
+    )
+    parser.add_argument(
+        "--camera-port",
+        metavar="PORT",
+        type=int,
+        default=12_345,
+        help="the camera stream port (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--controls-port",
+        metavar="PORT",
+        type=int,
+        default=23_456,
+        help="the controls port (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--provider",
+        dest="providers",
+        action="append",
+        choices=["openxr", "pygame"],
+        help="use this provider, can be given more than once"
+        " (default: all available)",
+    )
+    parser.add_argument(
+        "--playback",
+        metavar="FILE",
+        help="show a recording made with `vrcar server --record-video` instead of"
+        " connecting to a server",
+    )
+    parser.add_argument(
+        "--playback-speed",
+        metavar="FACTOR",
+        type=float,
+        default=1.0,
+        help="play back this many times faster, 0 for as fast as possible"
+        " (default: %(default)s)",
+    )
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(
+        "--legacy-controls",
+        action="store_true",
+        help="use the legacy per-field controls protocol",
+    )
+    group.add_argument(
+        "--udp-controls",
+        action="store_true",
+        help="send controls over UDP instead of TCP",
+    )
+    parser.add_argument(
+        "--control-rate",
+        metavar="HZ",
+        type=float,
+        default=60,
+        help="send controls at this fixed rate, 0 sends once per rendered frame"
+        " (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--head-prediction",
+        metavar="MS",
+        type=float,
+        default=100,
+        help="predict the VR head orientation this far ahead, 0 to disable"
+        " (default: %(default)s)",
+    )
+
+    parser = parsers.add_parser(
+        "bench",
+        help="run the hardware-free vrcar benchmarks",
+    )
+    parser.add_argument(
+        "benchmarks",
+        metavar="NAME",
+        nargs="*",
+        help="the benchmarks to run (default: all)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        metavar="FILE",
+        help="write the JSON results to FILE instead of stdout",
+    )
+
+    parser = parsers.add_parser(
+        "load",
+        help="run simulated clients against a vrcar server",
+    )
     parser.add_argument(
         "address",
         help="the address to connect to",
@@ -55,8 +226,132 @@ def parse_args():
         default=23_456,
         help="the controls port (default: %(default)s)",
     )
+    parser.add_argument(
+        "--camera-clients",
+        metavar="N",
+        type=int,
+        default=1,
+        help="the number of camera clients (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--controls-clients",
+        metavar="N",
+        type=int,
+        default=1,
+        help="the number of controls clients (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--rate",
+        metavar="HZ",
+        type=float,
+        default=60,
+        help="the controls send rate per client (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--udp-controls",
+        action="store_true",
+        help="send controls over UDP instead of TCP",
+    )
+    parser.add_argument(
+        "--udp-loss",
+        metavar="PERCENT",
+        type=float,
+        default=0,
+        help="drop this share of UDP controls datagrams (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--udp-delay",
+        metavar="MS",
+        type=float,
+        default=0,
+        help="delay UDP controls datagrams (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--udp-jitter",
+        metavar="MS",
+        type=float,
+        default=0,
+        help="add up to this much random delay, reordering datagrams"
+        " (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-d",
+        "--duration",
+        metavar="SECONDS",
+        type=float,
+        default=10,
+        help="how long to run the clients (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        metavar="FILE",
+        help="write the JSON results to FILE instead of stdout",
+    )
+
+    parser = parsers.add_parser(
+        "replay",
+        help="replay recorded controls against a vrcar server",
+    )
+    parser.add_argument(
+        "recording",
+        metavar="FILE",
+        help="a recording made with `vrcar server --record`",
+    )
+    parser.add_argument(
+        "address",
+        help="the address to connect to",
+    )
+    parser.add_argument(
+        "--controls-port",
+        metavar="PORT",
+        type=int,
+        default=23_456,
+        help="the controls port (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--udp-controls",
+        action="store_true",
+        help="send controls over UDP instead of TCP",
+    )
+    parser.add_argument(
+        "--speed",
+        metavar="FACTOR",
+        type=float,
+        default=1.0,
+        help="replay this many times faster than recorded (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        metavar="FILE",
+        help="write the JSON results to FILE instead of stdout",
+    )
+
+    args = root_parser.parse_args()
+    if args.mode == "client" and args.address is None and args.playback is None:
+        root_parser.error("the client requires an address unless using --playback")
+    impaired = args.mode == "load" and (
+        args.udp_loss or args.udp_delay or args.udp_jitter
+    )
+    if impaired and not args.udp_controls:
+        root_parser.error("injecting loss and delay requires --udp-controls")
+    if args.mode == "bench":
+        from vrcar.bench import BENCHMARKS
+
+        unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+        if unknown:
+            root_parser.error(
+                f"unknown benchmarks: {', '.join(unknown)}"
+                f" (available: {', '.join(BENCHMARKS)})"
+            )
+
+    return args
+
 
-    return root_parser.parse_args()
+def parse_size(value: str) -> tuple[int, int]:
+    width, _, height = value.partition("x")
+    return int(width), int(height)
 
 
 def main():
@@ -74,13 +369,89 @@ def main():
 
     if args.mode == "server":
         import vrcar.server
+        from vrcar.server.motors import load_config
+        from vrcar.server.quality import DEFAULT_PRESET, PRESETS
 
-        vrcar.server.run(args.bind, args.camera_port, args.controls_port)
+        preset = None
+        if args.size or args.framerate:
+            preset = PRESETS[DEFAULT_PRESET]
+            preset = preset._replace(
+                name="custom",
+                size=args.size or preset.size,
+                framerate=args.framerate or preset.framerate,
+            )
+
+        vrcar.server.run(
+            args.bind,
+            args.camera_port,
+            args.controls_port,
+            udp_controls=args.udp_controls,
+            failsafe_timeout=args.failsafe_timeout / 1000,
+            codec=args.codec,
+            adaptive_quality=args.adaptive_quality,
+            simulate=args.simulate,
+            preset=preset,
+            bitrate=int(args.simulate_bitrate * 1e6),
+            actuator_rate=args.actuator_rate,
+            servo_slew=args.servo_slew,
+            motor_config=load_config(args.motor_config) if args.motor_config else None,
+            record=args.record,
+            record_video=args.record_video,
+            warm_camera=args.warm_camera,
+        )
 
     elif args.mode == "client":
         import vrcar.client
 
-        vrcar.client.run(args.address, args.camera_port, args.controls_port)
+        vrcar.client.run(
+            args.address,
+            args.camera_port,
+            args.controls_port,
+            legacy_controls=args.legacy_controls,
+            udp_controls=args.udp_controls,
+            control_rate=args.control_rate,
+            head_prediction=args.head_prediction / 1000,
+            playback=args.playback,
+            playback_speed=args.playback_speed,
+            provider_names=args.providers,
+        )
+
+    elif args.mode == "bench":
+        import vrcar.bench
+
+        vrcar.bench.main(args.benchmarks, args.output)
+
+    elif args.mode == "load":
+        import vrcar.load
+
+        vrcar.load.main(
+            args.address,
+            args.camera_port,
+            args.controls_port,
+            args.output,
+            camera_clients=args.camera_clients,
+            controls_clients=args.controls_clients,
+            rate=args.rate,
+            udp_controls=args.udp_controls,
+            duration=args.duration,
+            impairment=(
+                (args.udp_loss / 100, args.udp_delay / 1000, args.udp_jitter / 1000)
+                if args.udp_loss or args.udp_delay or args.udp_jitter
+                else None
+            ),
+        )
+
+    elif args.mode == "replay":
+        import vrcar.replay
+
+        vrcar.replay.main(
+            args.recording,
+            args.address,
+            args.controls_port,
+            args.output,
+            udp_controls=args.udp_controls,
+            speed=args.speed,
+        )
 
 
 if __name__ == "__main__":
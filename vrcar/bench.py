@@ -0,0 +1,751 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import importlib.util
+import io
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import queue
+import socket
+import statistics
+import threading
+import time
+import tracemalloc
+import typing
+
+if typing.TYPE_CHECKING:
+    from collections.abc import Callable, Coroutine
+
+BENCHMARKS: dict[str, Callable[[], dict[str, typing.Any]]] = {}
+
+
+def benchmark(func: Callable[[], dict[str, typing.Any]]):
+    BENCHMARKS[func.__name__.removeprefix("bench_")] = func
+    return func
+
+
+def _rate(func: Callable[[], typing.Any], duration: float = 1.0) -> float:
+    """Call `func` repeatedly for `duration` seconds and return calls per second"""
+    calls = 0
+    start = time.perf_counter()
+    end = start + duration
+    while (now := time.perf_counter()) < end:
+        for _ in range(100):
+            func()
+        calls += 100
+
+    return calls / (now - start)
+
+
+def _jpeg(size: tuple[int, int] = (1024, 768)) -> bytes | None:
+    if importlib.util.find_spec("PIL") is None:
+        return None
+
+    from PIL import Image
+
+    # a gradient compresses roughly like a camera image
+    image = Image.linear_gradient("L").resize(size).convert("RGB")
+    with io.BytesIO() as buffer:
+        image.save(buffer, "JPEG", quality=85)
+        return buffer.getvalue()
+
+
+def _fake_pwm():
+    from vrcar.server.pwm import PCA9685, FakeSMBus
+
+    if PCA9685.default_bus is None:
+        PCA9685.default_bus = FakeSMBus()
+
+    return PCA9685.default_bus
+
+
+def _summary(samples: list[float], scale: float = 1e6) -> dict[str, float]:
+    samples = sorted(samples)
+    return {
+        "mean": statistics.fmean(samples) * scale,
+        "p50": samples[len(samples) // 2] * scale,
+        "p99": samples[int(len(samples) * 0.99)] * scale,
+    }
+
+
+def _handoff(write, wait, frames: int = 2_000) -> dict[str, typing.Any]:
+    written = [0.0] * frames
+    latencies = []
+    received = set()
+
+    def consume():
+        while True:
+            frame = wait()
+            now = time.perf_counter()
+            index = int.from_bytes(frame[:4], "big")
+            if index == frames - 1:
+                return
+            if index not in received:
+                received.add(index)
+                latencies.append(now - written[index])
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    time.sleep(0.01)
+
+    payload = bytes(50_000)
+    for index in range(frames):
+        frame = index.to_bytes(4, "big") + payload
+        written[index] = time.perf_counter()
+        write(frame)
+        time.sleep(0.0002)
+
+    # the last frame might be missed by the consumer, so keep repeating it
+    while consumer.is_alive():
+        write(frame)
+        consumer.join(0.001)
+    return {
+        **_summary(latencies),
+        "skipped": frames - 1 - len(received),
+    }
+
+
+@benchmark
+def bench_frame_handoff():
+    """Encoder to consumer handoff latency in microseconds"""
+    from vrcar.server.frames import StreamingOutput
+
+    frame = None
+    condition = multiprocessing.Condition()
+
+    def condition_write(buf):
+        nonlocal frame
+        with condition:
+            frame = buf
+            condition.notify_all()
+
+    def condition_wait():
+        with condition:
+            condition.wait()
+            return frame
+
+    stream = StreamingOutput()
+    sequence = 0
+
+    def stream_wait():
+        nonlocal sequence
+        frame = stream.wait_for_newer(sequence)
+        sequence = frame.sequence
+        return frame.data
+
+    return {
+        "condition": _handoff(condition_write, condition_wait),
+        "ring": _handoff(stream.write, stream_wait),
+    }
+
+
+def _serve_frames(
+    frames: int, size: int, legacy: bool, payload: bytes | None = None
+) -> tuple[str, int]:
+    from vrcar.common import frame_header_struct
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+
+    def send():
+        client, _ = server.accept()
+        with client:
+            data = payload if payload is not None else bytes(size)
+            if legacy:
+                header = len(data).to_bytes(4, "big")
+            else:
+                header = frame_header_struct.pack(len(data), 0, 0, 0, 0, 0)
+            frame = header + data
+            for _ in range(frames):
+                client.sendall(frame)
+        server.close()
+
+    threading.Thread(target=send, daemon=True).start()
+    return server.getsockname()
+
+
+class _NullProvider:
+    def __init__(self):
+        self.transient: list[int] = []
+        self._current = 0
+
+    def draw(self, frame):
+        if not tracemalloc.is_tracing():
+            return
+
+        # memory allocated and freed again since the last frame was handed out
+        current, peak = tracemalloc.get_traced_memory()
+        self.transient.append(peak - self._current)
+        self._current = current
+        tracemalloc.reset_peak()
+
+
+def _legacy_camera_run(address: tuple[str, int], providers: list):
+    sock = socket.create_connection(address)
+    with sock:
+        while data := sock.recv(4):
+            length = int.from_bytes(data, "big")
+
+            position = 0
+            with io.BytesIO() as buffer:
+                while position < length:
+                    data = sock.recv(length - position)
+                    position += buffer.write(data)
+
+                for provider in providers:
+                    buffer.seek(0)
+                    provider.draw(buffer)
+
+
+class _NullDecoder:
+    def __init__(self, pool, providers: list):
+        self._pool = pool
+        self._providers = providers
+        self.decoded = self.skipped = 0
+        self.decode_time = 0.0
+
+    def start(self):
+        pass
+
+    def submit(self, buffer: bytearray, length: int, timing):
+        with memoryview(buffer) as view, view[:length] as frame:
+            for provider in self._providers:
+                provider.draw(frame)
+
+        self._pool.release(buffer)
+
+
+def _camera_run(address: tuple[str, int], providers: list):
+    from vrcar.client.camera import Camera
+
+    camera = Camera(address, [])
+    # only measure receiving, not decoding
+    camera._decoder = _NullDecoder(camera._pool, providers)
+    with camera._socket:
+        camera.run()
+
+
+@benchmark
+def bench_camera_receive(frames: int = 2_000, size: int = 120_000):
+    """Client frame receive cost and throughput over a loopback socket
+
+    Uses a synthetic JPEG frame as payload if Pillow is available.
+    """
+    payload = _jpeg()
+    if payload is not None:
+        size = len(payload)
+
+    results = {}
+    for name, func in (("bytesio", _legacy_camera_run), ("pool", _camera_run)):
+        legacy = func is _legacy_camera_run
+        address = _serve_frames(frames, size, legacy, payload)
+        start = time.process_time()
+        wall_start = time.perf_counter()
+        func(address, [_NullProvider()])
+        elapsed = time.perf_counter() - wall_start
+        cpu = time.process_time() - start
+
+        address = _serve_frames(frames, size, legacy, payload)
+        provider = _NullProvider()
+        tracemalloc.start()
+        func(address, [provider])
+        tracemalloc.stop()
+
+        # skip the first frames to ignore initial allocations
+        transient = statistics.fmean(provider.transient[10:])
+        results[name] = {
+            "frames_per_s": frames / elapsed,
+            "mb_per_s": frames * size / elapsed / 1e6,
+            "cpu_us_per_frame": cpu / frames * 1e6,
+            "transient_kib_per_frame": transient / 1024,
+        }
+
+    return results
+
+
+def _encode_h264(frames: int, size: tuple[int, int]) -> list[bytes]:
+    import av
+
+    codec = av.CodecContext.create("libx264", "w")
+    codec.width, codec.height = size
+    codec.pix_fmt = "yuv420p"
+    codec.options = {"tune": "zerolatency", "bframes": "0", "g": "15"}
+
+    packets = []
+    for index in range(frames):
+        image = av.VideoFrame(*size, "rgb24")
+        image.planes[0].update(bytes([index % 256]) * (size[0] * size[1] * 3))
+        packets.extend(bytes(packet) for packet in codec.encode(image))
+    packets.extend(bytes(packet) for packet in codec.encode(None))
+
+    return packets
+
+
+@benchmark
+def bench_h264_decode(frames: int = 120):
+    """Round trip a synthetic H.264 stream through the client decoder"""
+    if importlib.util.find_spec("av") is None:
+        return {"skipped": "PyAV is not installed"}
+
+    from vrcar.client import latency
+    from vrcar.client.camera import BufferPool
+    from vrcar.client.decoder import Decoder
+    from vrcar.common import CAM_HEIGHT, CAM_WIDTH
+
+    packets = _encode_h264(frames, (CAM_WIDTH, CAM_HEIGHT))
+
+    # length and center pixel of each drawn frame
+    drawn = []
+
+    class Provider:
+        def draw(self, frame, size, timing):
+            center = (size[1] // 2 * size[0] + size[0] // 2) * 3
+            drawn.append((len(frame), bytes(frame[center : center + 3])))
+
+    pool = BufferPool(3)
+    decoder = Decoder([Provider()], pool)
+    decoder.start()
+
+    start = time.perf_counter()
+    for packet in packets:
+        buffer = pool.acquire(len(packet))
+        buffer[: len(packet)] = packet
+        now = time.time()
+        decoder.submit(buffer, len(packet), latency.stats.frame(0, now, now, now))
+
+    decoder.wait_finished(len(packets))
+    elapsed = time.perf_counter() - start
+
+    # the synthetic frames are uniformly gray, with the frame index as value
+    if decoder.failed:
+        raise ValueError(f"{decoder.failed} frames failed to decode")
+    if not drawn:
+        raise RuntimeError("No frames were drawn")
+    for length, _ in drawn:
+        if length != CAM_WIDTH * CAM_HEIGHT * 3:
+            raise ValueError(f"Drawn frame has {length} bytes instead of RGB")
+    expected = (frames - 1) % 256
+    if any(abs(value - expected) > 3 for value in drawn[-1][1]):
+        raise ValueError(f"Last drawn pixel is {tuple(drawn[-1][1])}, not {expected}")
+
+    return {
+        "packets": len(packets),
+        "drawn": len(drawn),
+        "us_per_frame": elapsed / len(packets) * 1e6,
+    }
+
+
+def _legacy_mix(
+    drive: float, strafe: float, turn: float, maximum: int = 4095
+) -> list[tuple[int, int]]:
+    # the averaging mixer `Motors.move` used before the mixing matrix
+    values = []
+    if abs(drive) > 0.3:
+        values.append((drive, drive, drive, drive))
+    if abs(strafe) > 0.3:
+        values.append((strafe, -strafe, -strafe, strafe))
+    if abs(turn) > 0.3:
+        values.append((turn, turn, -turn, -turn))
+    if not values:
+        values.append((0, 0, 0, 0))
+
+    channels = [(0, 0)] * 8
+    for (a, b), duties in zip(((0, 1), (3, 2), (6, 7), (4, 5)), zip(*values)):
+        duty = int(min(max(-1.0, statistics.fmean(duties)), 1.0) * maximum)
+        if duty > 0:
+            channels[a] = (0, 0)
+            channels[b] = (0, duty)
+        elif duty < 0:
+            channels[a] = (0, -duty)
+            channels[b] = (0, 0)
+        else:
+            channels[a] = (0, maximum)
+            channels[b] = (0, maximum)
+
+    return channels
+
+
+@benchmark
+def bench_motors():
+    """Motors mixing cost, and move calls and I2C transactions per second"""
+    from vrcar.server.motors import MotorConfig, Motors
+    from vrcar.server.pwm import FakeSMBus
+
+    bus = FakeSMBus()
+    motors = Motors(bus)
+    curved = Motors(bus, MotorConfig(curve=(0.0, 0.2, 0.5, 1.0)))
+    results = {}
+
+    inputs = [(1.0, 0.0, 0.5), (0.8, -0.6, 0.0), (0.0, 0.0, 0.0), (1.0, 1.0, 1.0)]
+    for name, mix in (
+        ("mix_legacy", _legacy_mix),
+        ("mix_matrix", motors.mix),
+        ("mix_matrix_curve", curved.mix),
+    ):
+        rate = _rate(lambda mix=mix: [mix(*values) for values in inputs])
+        results[name] = {"ns_per_call": 1e9 / (rate * len(inputs))}
+
+    values = iter(range(1 << 62))
+
+    def changing():
+        # always produce a different duty so every call hits the bus
+        motors.move(0.4 + next(values) % 50 / 100)
+
+    for name, func in (
+        ("identical", lambda: motors.move(1.0, 0.0, 0.5)),
+        ("changing", changing),
+    ):
+        bus.transactions = 0
+        start = time.perf_counter()
+        rate = _rate(func)
+        elapsed = time.perf_counter() - start
+        results[name] = {
+            "calls_per_s": rate,
+            "transactions_per_s": bus.transactions / elapsed,
+        }
+
+    return results
+
+
+@benchmark
+def bench_servos():
+    """Servos.set calls and I2C transactions per second on a fake bus"""
+    from vrcar.server.pwm import FakeSMBus
+    from vrcar.server.servos import Servos
+
+    bus = FakeSMBus()
+    servos = Servos(bus)
+    angles = iter(range(1 << 62))
+
+    bus.transactions = 0
+    start = time.perf_counter()
+    rate = _rate(lambda: servos.set(0, 40 + next(angles) % 100))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "calls_per_s": rate,
+        "transactions_per_s": bus.transactions / elapsed,
+    }
+
+
+def _free_port(kind: int) -> int:
+    with socket.socket(socket.AF_INET, kind) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def _serving(server: Coroutine):
+    """Run the `server` coroutine on its own loop until the block exits"""
+    started: queue.Queue[tuple[asyncio.AbstractEventLoop, asyncio.Task]] = queue.Queue()
+
+    async def main():
+        started.put((asyncio.get_running_loop(), asyncio.current_task()))
+        await server
+
+    def run():
+        # asyncio.run also cancels the client sessions when the server ends
+        with contextlib.suppress(asyncio.CancelledError):
+            asyncio.run(main())
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    loop, task = started.get()
+    try:
+        yield
+    finally:
+        loop.call_soon_threadsafe(task.cancel)
+        thread.join()
+
+
+@benchmark
+def bench_controls(frames: int = 5_000):
+    """Control frames per second from `Controls` through the server loop"""
+    from vrcar.client.controls import Controls
+    from vrcar.server import controls
+
+    _fake_pwm()
+    results = {}
+    for name, udp, legacy in (
+        ("legacy", False, True),
+        ("tcp", False, False),
+        ("udp", True, False),
+    ):
+        port = _free_port(socket.SOCK_DGRAM if udp else socket.SOCK_STREAM)
+        address = ("127.0.0.1", port)
+        with _serving(controls.serve(address, udp)):
+            time.sleep(0.1)
+
+            client = Controls(address, [], legacy=legacy, udp=udp)
+            start = time.perf_counter()
+            for index in range(frames):
+                client.state[next(iter(client.state))] = index % 2
+                if legacy:
+                    for command, value in client.state.items():
+                        client.send(command, value)
+                else:
+                    client.send_state()
+                    if udp and index % 64 == 0:
+                        # keep the socket buffers from overflowing
+                        time.sleep(0.0005)
+            sent = time.perf_counter() - start
+
+            deadline = time.monotonic() + 2
+            while (
+                not legacy and client.rtt.count < frames and time.monotonic() < deadline
+            ):
+                time.sleep(0.001)
+            acknowledged = time.perf_counter() - start
+
+            results[name] = {
+                "sent_per_s": frames / sent,
+                "acknowledged": client.rtt.count,
+                "acknowledged_per_s": client.rtt.count / acknowledged,
+                "rtt_p50_ms": client.rtt.percentile(50) if client.rtt.count else None,
+            }
+            # shut down first, the ack reader thread blocks the close
+            with contextlib.suppress(OSError):
+                client._socket.shutdown(socket.SHUT_RDWR)
+            client._socket.close()
+            # let the session end before the server is stopped
+            time.sleep(0.1)
+
+    return results
+
+
+@benchmark
+def bench_decode():
+    """Decode cost per frame of each available JPEG decode path"""
+    from vrcar.client import decoder
+
+    jpeg = _jpeg()
+    if jpeg is None:
+        return {"skipped": "Pillow is not installed"}
+
+    results = {}
+    for name, func in (
+        ("pil", decoder._decode_pil),
+        ("pygame", decoder._decode_pygame),
+    ):
+        if importlib.util.find_spec("PIL" if name == "pil" else "pygame") is None:
+            continue
+        with memoryview(jpeg) as frame:
+            results[name] = {"us_per_frame": 1e6 / _rate(lambda: func(frame))}
+
+    return results
+
+
+@benchmark
+def bench_pygame_draw():
+    """`PygameProvider.draw` cost per decoded frame of each preset size
+
+    Uses a dummy display, frames smaller than the window are scaled up.
+    """
+    if importlib.util.find_spec("pygame") is None:
+        return {"skipped": "pygame is not installed"}
+
+    from vrcar.client.latency import FrameTiming
+    from vrcar.server.quality import PRESETS
+
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    from vrcar.client.provider.pygame import PygameProvider
+
+    timing = FrameTiming(0, 0.0, 0.0, 0.0)
+    results = {}
+    with PygameProvider() as provider:
+        for width, height in sorted({preset.size for preset in PRESETS}):
+            with memoryview(bytes(width * height * 3)) as frame:
+                rate = _rate(lambda: provider.draw(frame, (width, height), timing))
+            results[f"{width}x{height}"] = {"us_per_frame": 1e6 / rate}
+
+    return results
+
+
+@benchmark
+def bench_video(frames: int = 1_000):
+    """Recording cost for the camera thread, seeking and playback frame rate"""
+    import random
+    import tempfile
+
+    from vrcar.client.playback import Playback
+    from vrcar.common import Frame
+    from vrcar.video import VideoRecording, VideoWriter
+
+    jpeg = _jpeg()
+    if jpeg is None:
+        return {"skipped": "Pillow is not installed"}
+
+    drawn = []
+
+    class Provider:
+        def draw(self, frame, size, timing):
+            drawn.append(time.perf_counter())
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = f"{directory}/video.mjpeg"
+        writer = VideoWriter(path)
+        writer.start()
+        samples = []
+        with memoryview(jpeg) as data:
+            for sequence in range(frames):
+                frame = Frame(data, sequence, True, sequence / 30)
+                start = time.perf_counter()
+                writer.put(frame)
+                samples.append(time.perf_counter() - start)
+                # spaced out like camera frames, but faster
+                time.sleep(0.001)
+        writer.close()
+
+        recording = VideoRecording(path)
+        duration = recording.timestamp(len(recording) - 1)
+        seek_rate = _rate(lambda: recording.seek(random.uniform(0, duration)))
+        recording.close()
+
+        playback = Playback(path, [Provider()], speed=0)
+        start = time.perf_counter()
+        playback.start()
+        playback.join()
+        playback._wait_decoded()
+        elapsed = time.perf_counter() - start
+
+    return {
+        "put_us": _summary(samples),
+        "written": writer.written,
+        "dropped": writer.dropped,
+        "seek_us": 1e6 / seek_rate,
+        "playback": {
+            "frames": playback.received,
+            "drawn": len(drawn),
+            "fps": playback.received / elapsed,
+        },
+    }
+
+
+@benchmark
+def bench_log_format():
+    """`PrettyFormatter.format` cost per record"""
+    from vrcar.log import PrettyFormatter
+
+    results = {}
+    for use_color in (False, True):
+        formatter = PrettyFormatter(use_color=use_color)
+        record = logging.LogRecord(
+            "vrcar.bench", logging.INFO, __file__, 0, "frame %d sent", (1,), None
+        )
+        name = "color" if use_color else "plain"
+        results[name] = {"us_per_record": 1e6 / _rate(lambda: formatter.format(record))}
+
+    return results
+
+
+@benchmark
+def bench_log_call(calls: int = 2_000):
+    """Microseconds a log call blocks the caller, with and without a queue"""
+    import logging.handlers
+    import queue
+    import tempfile
+
+    from vrcar.log import PrettyFormatter, QueueHandler
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory, open(os.devnull, "w") as null:
+        for name in ("direct", "queued"):
+            logger = logging.getLogger(f"vrcar.bench.{name}")
+            logger.propagate = False
+            logger.setLevel(logging.DEBUG)
+
+            file_handler = logging.FileHandler(f"{directory}/{name}.log")
+            file_handler.setFormatter(PrettyFormatter(use_color=False))
+            stream_handler = logging.StreamHandler(null)
+            stream_handler.setFormatter(PrettyFormatter(use_color=True))
+            handlers = [file_handler, stream_handler]
+
+            listener = None
+            if name == "queued":
+                records: queue.SimpleQueue = queue.SimpleQueue()
+                listener = logging.handlers.QueueListener(records, *handlers)
+                listener.start()
+                handlers = [QueueHandler(records)]
+
+            for handler in handlers:
+                logger.addHandler(handler)
+
+            # spaced out like real logging, so the listener is idle between calls
+            samples = []
+            for index in range(calls):
+                start = time.perf_counter()
+                logger.info("frame %d sent", index)
+                samples.append(time.perf_counter() - start)
+                time.sleep(0.0002)
+            results[name] = {
+                "spaced_us": _summary(samples),
+                "burst_us_per_call": 1e6
+                / _rate(lambda logger=logger: logger.info("frame %d sent", 1)),
+            }
+
+            if listener is not None:
+                listener.stop()
+            for handler in handlers:
+                logger.removeHandler(handler)
+            file_handler.close()
+
+    return results
+
+
+@contextlib.contextmanager
+def _private_latency_stats():
+    """Keep the benchmarks' frames out of the client's latency stats and logs"""
+    import tempfile
+
+    from vrcar.client import latency
+
+    previous = latency.stats
+    with tempfile.TemporaryDirectory() as directory:
+        latency.stats = latency.LatencyStats(directory)
+        try:
+            yield
+        finally:
+            latency.stats = previous
+
+
+def run(names: list[str] | None = None) -> dict[str, typing.Any]:
+    import vrcar
+
+    unknown = [name for name in names or () if name not in BENCHMARKS]
+    if unknown:
+        raise ValueError(f"Unknown benchmarks: {', '.join(unknown)}")
+
+    results = {}
+    for name in names or BENCHMARKS:
+        try:
+            with _private_latency_stats():
+                results[name] = BENCHMARKS[name]()
+        except Exception as error:
+            results[name] = {"error": repr(error)}
+
+    return {
+        "version": vrcar.__version__,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "time": time.time(),
+        "results": results,
+    }
+
+
+def main(names: list[str] | None = None, output: str | None = None):
+    data = json.dumps(run(names), indent=2)
+    if output is None:
+        print(data)
+        return
+
+    with open(output, "w", encoding="utf8") as file:
+        file.write(data)
+
+
+if __name__ == "__main__":
+    main()
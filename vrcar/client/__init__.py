@@ -1,25 +1,75 @@
 from __future__ import annotations
 
 import contextlib
+import importlib
 import logging
+import typing
 
+from vrcar.client import latency
 from vrcar.client.camera import Camera
-from vrcar.client.controls import Controls
+from vrcar.client.controls import Controls, ControlScheduler
+from vrcar.common import Commands
+from vrcar.timeline import timeline
 
 logger = logging.getLogger(__name__)
 
+# module and class of each provider, highest priority first
+PROVIDERS = {
+    "openxr": ("vrcar.client.provider.openxr", "OpenXRProvider"),
+    "pygame": ("vrcar.client.provider.pygame", "PygameProvider"),
+}
 
-def run(address: str, camera_port: int, controls_port: int):
-    from vrcar.client.provider.openxr import OpenXRProvider
-    from vrcar.client.provider.pygame import PygameProvider
 
-    all_providers = [OpenXRProvider, PygameProvider]
+def _import_provider(name: str) -> typing.Any:
+    """Import a provider when it is used, as they pull in OpenGL or pygame"""
+    module, class_name = PROVIDERS[name]
+    return getattr(importlib.import_module(module), class_name)
 
+
+def _play(path: str, speed: float, providers: list):
+    """Show a video recording on the providers without a server"""
+    from vrcar.client.playback import Playback
+
+    playback = Playback(path, providers, speed)
+    playback.start()
+    state = dict.fromkeys(Commands, 0.0)
+    try:
+        # highest priority last, like `Controls.update`
+        while playback.is_alive() and all(
+            provider.update(state) for provider in reversed(providers)
+        ):
+            providers[0].wait()
+    finally:
+        latency.stats.dump()
+
+
+def run(
+    address: str | None,
+    camera_port: int,
+    controls_port: int,
+    legacy_controls: bool = False,
+    udp_controls: bool = False,
+    control_rate: float = 60.0,
+    head_prediction: float = 0.1,
+    playback: str | None = None,
+    playback_speed: float = 1.0,
+    provider_names: list[str] | None = None,
+):
+    """Run the client with the given providers, or all available ones"""
+    timeline.mark("client started")
     providers = []
     with contextlib.ExitStack() as stack:
-        for provider in all_providers:
+        for name in PROVIDERS:
+            if provider_names and name not in provider_names:
+                continue
+
+            provider = _import_provider(name)
             if not provider.available:
+                if provider_names:
+                    logger.error(f"The {name} provider is missing dependencies")
                 continue
+            if name == "openxr":
+                provider.prediction_horizon = head_prediction
 
             try:
                 result = stack.enter_context(provider())
@@ -31,16 +81,40 @@ def run(address: str, camera_port: int, controls_port: int):
         if not providers:
             logger.error("No available providers found")
             return
+        timeline.mark("providers ready")
+
+        if playback is not None:
+            _play(playback, playback_speed, providers)
+            return
 
         camera = Camera((address, camera_port), providers)
-        controls = Controls((address, controls_port), providers)
+        controls = Controls(
+            (address, controls_port),
+            providers,
+            legacy=legacy_controls,
+            udp=udp_controls,
+        )
+        timeline.mark("connected")
+
+        scheduler = None
+        if control_rate:
+            scheduler = ControlScheduler(controls, control_rate)
+            scheduler.start()
 
         camera.start()
-        while controls.update():
-            print(
-                ", ".join(
-                    f"{cmd.name.lower()}={value:5.2f}"
-                    for cmd, value in controls.state.items()
-                ),
-                end="\r",
-            )
+        try:
+            while controls.update():
+                status = controls.status()
+                if scheduler is not None:
+                    status += f" | {scheduler.status()}"
+                print(status, end="\r")
+        finally:
+            if scheduler is not None:
+                scheduler.stop()
+                logger.info(
+                    f"Session control ticks: {scheduler.ticks} sent,"
+                    f" {scheduler.missed} missed, jitter {scheduler.jitter.summary()}"
+                )
+            if controls.rtt.count:
+                logger.info(f"Session control round trip: {controls.rtt.summary()}")
+            latency.stats.dump()
@@ -1,33 +1,96 @@
 from __future__ import annotations
 
-import io
+import queue
 import socket
 import threading
+import time
 import typing
 
+from vrcar.client import latency
+from vrcar.client.decoder import Decoder
+from vrcar.common import feedback_struct, frame_header_struct, recv_exact
+from vrcar.timeline import timeline
+
 if typing.TYPE_CHECKING:
+    from vrcar.client.decoder import Drawable
+
+
+class BufferPool:
+    """Reusable receive buffers, grown only when a frame exceeds capacity"""
+
+    def __init__(self, count: int = 3, size: int = 256 * 1024):
+        self._free: queue.SimpleQueue[bytearray] = queue.SimpleQueue()
+        for _ in range(count):
+            self._free.put(bytearray(size))
+        self.allocations = count
 
-    class Drawable(typing.Protocol):
-        def draw(self, buffer: io.BytesIO) -> None:
-            pass
+    def acquire(self, size: int) -> bytearray:
+        buffer = self._free.get()
+        if len(buffer) < size:
+            buffer = bytearray(max(size, len(buffer) * 2))
+            self.allocations += 1
+
+        return buffer
+
+    def release(self, buffer: bytearray):
+        self._free.put(buffer)
 
 
 class Camera(threading.Thread):
+    FEEDBACK_INTERVAL = 1.0
+
     def __init__(self, address: tuple[str, int], providers: list[Drawable]):
         self._socket = socket.create_connection(address)
-        self._providers = providers
+        # one buffer is received into, one pending and one being decoded
+        self._pool = BufferPool(3)
+        self._decoder = Decoder(providers, self._pool)
+        self.received = 0
         super().__init__(daemon=True)
 
+    def _snapshot(self) -> tuple[int, int, int, float]:
+        decoder = self._decoder
+        return self.received, decoder.decoded, decoder.skipped, decoder.decode_time
+
+    def _send_feedback(self):
+        snapshot = self._snapshot()
+        received, decoded, skipped, decode_time = (
+            current - previous
+            for current, previous in zip(snapshot, self._last_snapshot)
+        )
+        self._last_snapshot = snapshot
+
+        decode_average = decode_time / decoded if decoded else 0.0
+        self._socket.sendall(
+            feedback_struct.pack(received, skipped, decode_average, time.time())
+        )
+
     def run(self):
-        while data := self._socket.recv(4):
-            length = int.from_bytes(data, "big")
-
-            position = 0
-            with io.BytesIO() as buffer:
-                while position < length:
-                    data = self._socket.recv(length - position)
-                    position += buffer.write(data)
-
-                for provider in self._providers:
-                    buffer.seek(0)
-                    provider.draw(buffer)
+        self._decoder.start()
+        header = bytearray(frame_header_struct.size)
+        header_view = memoryview(header)
+        self._last_snapshot = self._snapshot()
+        next_feedback = time.monotonic() + self.FEEDBACK_INTERVAL
+
+        while recv_exact(self._socket, header_view):
+            length, sequence, captured, sent, echo_sent, echo_received = (
+                frame_header_struct.unpack(header)
+            )
+            if echo_sent:
+                latency.stats.sync(echo_sent, echo_received, sent)
+
+            buffer = self._pool.acquire(length)
+            with memoryview(buffer) as view, view[:length] as frame:
+                if not recv_exact(self._socket, frame):
+                    break
+
+            timing = latency.stats.frame(sequence, captured, sent, time.time())
+            latency.stats.received(timing)
+            self._decoder.submit(buffer, length, timing)
+            if not self.received:
+                timeline.mark("first frame received")
+            self.received += 1
+
+            now = time.monotonic()
+            if now >= next_feedback:
+                next_feedback = now + self.FEEDBACK_INTERVAL
+                self._send_feedback()
@@ -1,14 +1,29 @@
 from __future__ import annotations
 
+import contextlib
+import heapq
 import logging
+import random
 import socket
+import threading
+import time
 import typing
 
-from vrcar.common import Commands, float_struct
+from vrcar.client.latency import Histogram
+from vrcar.common import (
+    FRAME_ACK,
+    FRAME_HANDSHAKE,
+    Commands,
+    ack_struct,
+    float_struct,
+    frame_struct,
+    recv_exact,
+)
 
 logger = logging.getLogger()
 
 if typing.TYPE_CHECKING:
+    from collections.abc import Callable
 
     class Controllable(typing.Protocol):
         def update(self, buffer: dict[Commands, float]) -> None:
@@ -22,41 +37,319 @@ def clamp(value, minimum, maximum):
     return minimum if value < minimum else maximum if value > maximum else value
 
 
+def head_angle(value: float) -> int:
+    return clamp(int((value + 0.5) * 180), 40, 140)
+
+
+class Impairment(threading.Thread):
+    """Drop and delay datagrams, to test the UDP path over loopback
+
+    Each datagram is dropped with probability `loss`, or sent after `delay`
+    plus a random `jitter` seconds. Jitter larger than the send interval
+    reorders datagrams.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[bytes], typing.Any],
+        loss: float = 0.0,
+        delay: float = 0.0,
+        jitter: float = 0.0,
+    ):
+        self._send = send
+        self.loss = loss
+        self.delay = delay
+        self.jitter = jitter
+        self.dropped = 0
+        # deadline, order and data of the delayed datagrams
+        self._pending: list[tuple[float, int, bytes]] = []
+        self._count = 0
+        self._condition = threading.Condition()
+        super().__init__(daemon=True)
+
+    def send(self, data: bytes | bytearray):
+        if random.random() < self.loss:
+            self.dropped += 1
+            return
+
+        deadline = time.perf_counter() + self.delay + random.uniform(0, self.jitter)
+        with self._condition:
+            # copied, as the caller reuses its buffer
+            heapq.heappush(self._pending, (deadline, self._count, bytes(data)))
+            self._count += 1
+            self._condition.notify()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if not self._pending:
+                        self._condition.wait()
+                        continue
+                    remaining = self._pending[0][0] - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                _, _, data = heapq.heappop(self._pending)
+
+            with contextlib.suppress(OSError):
+                self._send(data)
+
+
 class Controls:
-    def __init__(self, address: tuple[str, int], providers: list[Controllable]):
-        self._socket = socket.create_connection(address)
+    STATUS_INTERVAL = 1.0
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        providers: list[Controllable],
+        legacy: bool = False,
+        udp: bool = False,
+        acks: bool = True,
+        impairment: tuple[float, float, float] | None = None,
+    ):
+        """`impairment` is the loss, delay and jitter to inject over UDP"""
+        if legacy and udp:
+            raise ValueError("the legacy controls protocol requires TCP")
+        if impairment and not udp:
+            raise ValueError("injecting loss and delay requires UDP")
+
+        self.impairment = None
+        if udp:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._socket.connect(address)
+            self._send = self._socket.send
+            if impairment:
+                self.impairment = Impairment(self._socket.send, *impairment)
+                self.impairment.start()
+                self._send = self.impairment.send
+        else:
+            self._socket = socket.create_connection(address)
+            self._send = self._socket.sendall
         self._providers = providers
+        self._legacy = legacy
+        self._sequence = 0
+        self._frame = bytearray(frame_struct.size)
+        self._udp = udp
 
+        # command to actuation round trip times, over the session and
+        # over the last status interval
+        self._acks = acks and not legacy
+        self.rtt = Histogram()
+        self._rtt_interval = Histogram()
+        self._rtt_previous = Histogram()
+        self._rtt_lock = threading.Lock()
+        self.sent = 0
+        self._sent_previous = 0
+        self.rate = 0.0
+        self._last_status = time.monotonic()
+        if self._acks:
+            threading.Thread(target=self._read_acks, daemon=True).start()
+
+        self.scheduler: ControlScheduler | None = None
         self.state: dict[Commands, float] = dict.fromkeys(Commands, 0.0)
-        for cmd, value in self.state.items():
-            self.send(cmd, value)
+        self._sent_state = self.state
+        if legacy:
+            for cmd, value in self.state.items():
+                self.send(cmd, value)
+        else:
+            if not udp:
+                self._socket.sendall(FRAME_HANDSHAKE)
+            self.send_state()
 
     def send(self, cmd: Commands, value: float):
         data = cmd.value
 
         if cmd in (Commands.HEAD_H, Commands.HEAD_V):
-            scaled = int((value + 0.5) * 180)
-            data += bytes([clamp(scaled, 40, 140)])
+            data += bytes([head_angle(value)])
 
         else:
             data += float_struct.pack(value)
 
-        self._socket.send(data)
+        self._socket.sendall(data)
+        self.sent += 1
+
+    def send_state(self):
+        state = self.state
+        self.send_frame(
+            state[Commands.MOVE],
+            state[Commands.STRAFE],
+            state[Commands.TURN],
+            head_angle(state[Commands.HEAD_H]),
+            head_angle(state[Commands.HEAD_V]),
+        )
+
+    def send_frame(
+        self, move: float, strafe: float, turn: float, head_h: int, head_v: int
+    ):
+        """Send a state frame with the head angles already in degrees"""
+        frame_struct.pack_into(
+            self._frame,
+            0,
+            self._sequence,
+            time.time(),
+            move,
+            strafe,
+            turn,
+            head_h,
+            head_v,
+            FRAME_ACK if self._acks else 0,
+        )
+        self._sequence = (self._sequence + 1) & 0xFFFF_FFFF
+        self._send(self._frame)
+        self.sent += 1
+
+    def _read_acks(self):
+        buffer = bytearray(ack_struct.size)
+        view = memoryview(buffer)
+
+        while True:
+            try:
+                if self._udp:
+                    if self._socket.recv_into(view) != ack_struct.size:
+                        continue
+                elif not recv_exact(self._socket, view):
+                    return
+            except ConnectionRefusedError:
+                # server not (yet) listening for datagrams
+                continue
+            except OSError:
+                return
+
+            _, timestamp = ack_struct.unpack(buffer)
+            rtt = time.time() - timestamp
+            with self._rtt_lock:
+                self.rtt.record(rtt)
+                self._rtt_interval.record(rtt)
 
-    def update(self):
-        previous_state = self.state.copy()
+    def status(self) -> str:
+        """Get a one line summary of the current state, RTT and command rate"""
+        now = time.monotonic()
+        if now - self._last_status >= self.STATUS_INTERVAL:
+            self.rate = (self.sent - self._sent_previous) / (now - self._last_status)
+            self._last_status = now
+            self._sent_previous = self.sent
+            with self._rtt_lock:
+                self._rtt_previous = self._rtt_interval
+                self._rtt_interval = Histogram()
+
+        state = ", ".join(
+            f"{cmd.name.lower()}={value:5.2f}" for cmd, value in self.state.items()
+        )
+        rtt = self._rtt_previous
+        if not rtt.count:
+            return f"{state} | rtt n/a | {self.rate:5.1f} cmd/s"
+
+        return (
+            f"{state} | rtt p50={rtt.percentile(50):g}ms"
+            f" p95={rtt.percentile(95):g}ms p99={rtt.percentile(99):g}ms"
+            f" | {self.rate:5.1f} cmd/s"
+        )
+
+    def update(self) -> bool:
+        """Sample the providers, and send the state unless a scheduler does"""
+        state = self.state.copy()
 
         # highest priority last
         for provider in reversed(self._providers):
-            running = provider.update(self.state)
+            running = provider.update(state)
             if not running:
                 return False
 
+        # replaced at once, so a scheduler never sends a partial update
+        self.state = state
         self._providers[0].wait()
 
+        if self.scheduler is None:
+            self.tick()
+
+        return True
+
+    def tick(self):
+        """Send the current state, changes since the last tick are coalesced"""
+        state = self.state
+        if not self._legacy:
+            self.send_state()
+            return
+
         for command in Commands:
-            value = self.state[command]
-            if value != previous_state[command]:
+            value = state[command]
+            if value != self._sent_state[command]:
                 self.send(command, value)
 
-        return True
+        self._sent_state = state
+
+
+class ControlScheduler(threading.Thread):
+    """Send the controls state at a fixed rate, independent of rendering
+
+    Ticks are scheduled against absolute deadlines, so a late tick does
+    not delay the following ones. If a whole interval is missed, the
+    schedule restarts instead of sending a burst of catch-up frames.
+    """
+
+    def __init__(self, controls: Controls, rate: float = 60.0):
+        self._controls = controls
+        self.rate = rate
+        self.interval = 1 / rate
+        self._stopped = threading.Event()
+        # lateness of each tick, in 0.1ms buckets
+        self.jitter = Histogram(0.0001)
+        self._jitter_interval = Histogram(0.0001)
+        self._jitter_previous = Histogram(0.0001)
+        self._jitter_lock = threading.Lock()
+        self.ticks = 0
+        self.missed = 0
+        self._ticks_previous = 0
+        self.tick_rate = 0.0
+        self._last_status = time.monotonic()
+        controls.scheduler = self
+        super().__init__(daemon=True)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def run(self):
+        deadline = time.perf_counter()
+        while not self._stopped.is_set():
+            deadline += self.interval
+            delay = deadline - time.perf_counter()
+            if delay > 0:
+                self._stopped.wait(delay)
+
+            now = time.perf_counter()
+            late = now - deadline
+            if late >= self.interval:
+                self.missed += int(late / self.interval)
+                deadline = now
+                late = 0.0
+
+            with self._jitter_lock:
+                self.jitter.record(late)
+                self._jitter_interval.record(late)
+            self.ticks += 1
+
+            try:
+                self._controls.tick()
+            except OSError as error:
+                logger.error(f"Failed to send controls: {error}")
+                return
+
+    def status(self) -> str:
+        """Get a one line summary of the achieved tick rate and jitter"""
+        now = time.monotonic()
+        if now - self._last_status >= Controls.STATUS_INTERVAL:
+            ticks = self.ticks
+            self.tick_rate = (ticks - self._ticks_previous) / (now - self._last_status)
+            self._last_status = now
+            self._ticks_previous = ticks
+            with self._jitter_lock:
+                self._jitter_previous = self._jitter_interval
+                self._jitter_interval = Histogram(0.0001)
+
+        jitter = self._jitter_previous
+        return (
+            f"{self.tick_rate:5.1f}/{self.rate:g} Hz"
+            f" jitter p50={jitter.percentile(50):g}ms p99={jitter.percentile(99):g}ms"
+        )
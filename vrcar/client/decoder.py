@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import importlib.util
+import io
+import logging
+import os
+import threading
+import time
+import typing
+
+from vrcar.client import latency
+from vrcar.timeline import timeline
+
+if typing.TYPE_CHECKING:
+    from vrcar.client.camera import BufferPool
+    from vrcar.client.latency import FrameTiming
+
+    class Drawable(typing.Protocol):
+        def draw(
+            self, frame: memoryview, size: tuple[int, int], timing: FrameTiming
+        ) -> None:
+            pass
+
+
+logger = logging.getLogger(__name__)
+
+
+def _decode_pil(data: memoryview) -> tuple[bytes, tuple[int, int]]:
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(data))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    return image.tobytes("raw", "RGB"), image.size
+
+
+def _decode_pygame(data: memoryview) -> tuple[bytes, tuple[int, int]]:
+    os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "1"
+    import pygame
+
+    image = pygame.image.load(io.BytesIO(data))
+    return pygame.image.tobytes(image, "RGB"), image.get_size()
+
+
+class _H264Decoder:
+    def __init__(self):
+        import av
+
+        self._av = av
+        self._codec = av.CodecContext.create("h264", "r")
+
+    def __call__(
+        self, frames: list[memoryview]
+    ) -> tuple[bytes, tuple[int, int]] | None:
+        # every received buffer is one access unit, so skip the parser
+        # and its one frame delay by creating packets directly
+        last = None
+        for data in frames:
+            for frame in self._codec.decode(self._av.Packet(bytes(data))):
+                last = frame
+
+        if last is None:
+            return None
+
+        size = width, height = last.width, last.height
+        plane = last.reformat(format="rgb24").planes[0]
+        row = width * 3
+        if plane.line_size == row:
+            return bytes(plane), size
+
+        view = memoryview(plane)
+        data = b"".join(
+            view[offset : offset + row]
+            for offset in range(0, plane.line_size * height, plane.line_size)
+        )
+        return data, size
+
+
+class Decoder(threading.Thread):
+    """Decode received frames once and hand the RGB data to providers
+
+    For JPEG only the newest frame is decoded; frames superseded while the
+    decoder was busy are skipped and their buffers returned to the pool.
+    H.264 frames depend on each other, so all of them are decoded but only
+    the newest is converted and drawn.
+
+    Frames are drawn at the size they were encoded with, which changes
+    with the quality preset, so providers scale them for display.
+    """
+
+    available = (
+        importlib.util.find_spec("PIL") is not None
+        or importlib.util.find_spec("pygame") is not None
+    )
+
+    def __init__(self, providers: list[Drawable], pool: BufferPool):
+        self._providers = providers
+        self._pool = pool
+        lock = threading.Lock()
+        self._condition = threading.Condition(lock)
+        # notified whenever frames were decoded, skipped or failed
+        self._finished = threading.Condition(lock)
+        self._pending: list[tuple[bytearray, int, FrameTiming]] = []
+        self._decode_jpeg = (
+            _decode_pil if importlib.util.find_spec("PIL") else _decode_pygame
+        )
+        self._decode_h264: _H264Decoder | None = None
+
+        self.decoded = 0
+        self.skipped = 0
+        self.failed = 0
+        self.decode_time = 0.0
+        super().__init__(daemon=True)
+
+    def submit(self, buffer: bytearray, length: int, timing: FrameTiming):
+        with self._condition:
+            # JPEG frames are independent, so only the newest one matters
+            if buffer[:2] == b"\xff\xd8":
+                for pending, _, _ in self._pending:
+                    self._pool.release(pending)
+                    self.skipped += 1
+                if self._pending:
+                    self._pending.clear()
+                    self._finished.notify_all()
+
+            self._pending.append((buffer, length, timing))
+            self._condition.notify()
+
+    def wait_finished(self, count: int, timeout: float | None = None) -> bool:
+        """Wait until `count` frames were decoded, skipped or failed"""
+        with self._condition:
+            return self._finished.wait_for(
+                lambda: self.decoded + self.skipped + self.failed >= count, timeout
+            )
+
+    def _decode(self, frames: list[memoryview]) -> tuple[bytes, tuple[int, int]] | None:
+        if frames[-1][:2] == b"\xff\xd8":
+            return self._decode_jpeg(frames[-1])
+
+        if self._decode_h264 is None:
+            if importlib.util.find_spec("av") is None:
+                raise RuntimeError("Decoding H.264 requires the `h264` extra")
+            logger.info("Receiving H.264 stream")
+            self._decode_h264 = _H264Decoder()
+
+        return self._decode_h264(frames)
+
+    def run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending)
+                pending = self._pending
+                self._pending = []
+
+            start = time.perf_counter()
+            frames = [memoryview(buffer)[:length] for buffer, length, _ in pending]
+            try:
+                decoded = self._decode(frames)
+            except Exception:
+                logger.exception("Failed to decode frame")
+                with self._condition:
+                    self.failed += len(pending)
+                    self._finished.notify_all()
+                continue
+            finally:
+                for frame in frames:
+                    frame.release()
+                for buffer, _, _ in pending:
+                    self._pool.release(buffer)
+
+            with self._condition:
+                self.decode_time += time.perf_counter() - start
+                self.decoded += len(pending)
+                self._finished.notify_all()
+            if decoded is None:
+                continue
+
+            timing = pending[-1][2]
+            latency.stats.decoded(timing)
+
+            data, size = decoded
+            with memoryview(data) as view:
+                for provider in self._providers:
+                    provider.draw(view, size, timing)
+
+            if not timeline.reported:
+                timeline.mark("first frame drawn")
+                timeline.report()
@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("capture_send", "network", "decode", "display", "total")
+
+
+class Histogram:
+    """Latency histogram with fixed size buckets, the last one collects outliers
+
+    The buckets are `resolution` seconds wide, 1ms by default.
+    """
+
+    BUCKETS = 1000
+
+    def __init__(self, resolution: float = 0.001):
+        self.resolution = resolution
+        self._scale = 1 / resolution
+        self.counts = [0] * (self.BUCKETS + 1)
+        self.count = 0
+
+    def record(self, seconds: float):
+        index = int(seconds * self._scale)
+        if index < 0:
+            index = 0
+        elif index > self.BUCKETS:
+            index = self.BUCKETS
+        self.counts[index] += 1
+        self.count += 1
+
+    def percentile(self, percent: float) -> float:
+        """Get the upper bound in milliseconds of the `percent` percentile"""
+        target = self.count * percent / 100
+        total = 0
+        for index, count in enumerate(self.counts):
+            total += count
+            if total >= target and total:
+                return round((index + 1) * self.resolution * 1000, 3)
+
+        return 0
+
+    def since(self, counts: list[int]) -> Histogram:
+        """Get the samples recorded since the bucket `counts` were copied"""
+        histogram = Histogram(self.resolution)
+        histogram.counts = [now - then for now, then in zip(self.counts, counts)]
+        histogram.count = sum(histogram.counts)
+        return histogram
+
+    def summary(self) -> str:
+        return (
+            f"p50={self.percentile(50):g}ms p95={self.percentile(95):g}ms"
+            f" p99={self.percentile(99):g}ms (n={self.count})"
+        )
+
+
+class FrameTiming:
+    __slots__ = ("captured", "decoded", "displayed", "received", "sent", "sequence")
+
+    def __init__(self, sequence: int, captured: float, sent: float, received: float):
+        self.sequence = sequence
+        # all times are converted to the client clock
+        self.captured = captured
+        self.sent = sent
+        self.received = received
+        self.decoded = 0.0
+        # set by the first provider presenting the frame
+        self.displayed = 0.0
+
+
+class LatencyStats:
+    """Per-stage frame latency, from capture on the car to display
+
+    The session is dumped to `directory`, next to the log files by default.
+    """
+
+    INTERVAL = 10.0
+    SYNC_SAMPLES = 8
+
+    def __init__(self, directory: str = "logs"):
+        self._directory = directory
+        self._lock = threading.Lock()
+        self.total = {stage: Histogram() for stage in STAGES}
+        # bucket counts at the last report, for the interval summaries
+        self._reported = {stage: list(self.total[stage].counts) for stage in STAGES}
+        self._next_report = time.monotonic() + self.INTERVAL
+        # server clock minus client clock
+        self.offset = 0.0
+        self._sync_samples: list[tuple[float, float]] = []
+
+    def sync(self, sent: float, server_received: float, server_sent: float):
+        """Update the clock offset from an NTP style time exchange"""
+        received = time.time()
+        rtt = (received - sent) - (server_sent - server_received)
+        offset = ((server_received - sent) + (server_sent - received)) / 2
+
+        samples = self._sync_samples
+        samples.append((rtt, offset))
+        del samples[: -self.SYNC_SAMPLES]
+        # the sample with the lowest round trip time is the most accurate one
+        self.offset = min(samples)[1]
+
+    def frame(
+        self, sequence: int, captured: float, sent: float, received: float
+    ) -> FrameTiming:
+        return FrameTiming(
+            sequence, captured - self.offset, sent - self.offset, received
+        )
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self.total[stage].record(seconds)
+
+    def received(self, timing: FrameTiming):
+        capture_send = timing.sent - timing.captured
+        network = timing.received - timing.sent
+        total = self.total
+        with self._lock:
+            total["capture_send"].record(capture_send)
+            total["network"].record(network)
+
+    def decoded(self, timing: FrameTiming):
+        timing.decoded = time.time()
+        self.record("decode", timing.decoded - timing.received)
+
+    def displayed(self, timing: FrameTiming | None):
+        """Record the display of a frame, only the first call per frame counts"""
+        if timing is None:
+            return
+
+        now = time.time()
+        total = self.total
+        with self._lock:
+            if timing.displayed:
+                return
+
+            timing.displayed = now
+            total["display"].record(now - timing.decoded)
+            total["total"].record(now - timing.captured)
+
+        if time.monotonic() >= self._next_report:
+            self._next_report = time.monotonic() + self.INTERVAL
+            self.report()
+
+    def report(self):
+        with self._lock:
+            interval = {
+                stage: histogram.since(self._reported[stage])
+                for stage, histogram in self.total.items()
+            }
+            self._reported = {
+                stage: list(histogram.counts) for stage, histogram in self.total.items()
+            }
+
+        logger.info(f"Clock offset to server: {self.offset * 1000:.1f}ms")
+        for stage, histogram in interval.items():
+            logger.info(f"Latency {stage:<12}: {histogram.summary()}")
+
+    def dump(self, path: str | None = None):
+        """Log the latency over the whole session and write it to a file"""
+        for stage, histogram in self.total.items():
+            logger.info(f"Session latency {stage:<12}: {histogram.summary()}")
+
+        if path is None:
+            name = datetime.now().strftime("latency_%Y-%m-%d_%H-%M-%S.json")
+            path = os.path.join(self._directory, name)
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf8") as file:
+            json.dump(
+                {
+                    "offset": self.offset,
+                    "bucket_ms": 1,
+                    "stages": {
+                        stage: histogram.counts
+                        for stage, histogram in self.total.items()
+                    },
+                },
+                file,
+            )
+        logger.info(f"Wrote latency histograms to {path}")
+
+
+stats = LatencyStats()
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+import typing
+
+from vrcar.client import latency
+from vrcar.client.camera import BufferPool
+from vrcar.client.decoder import Decoder
+from vrcar.video import VideoRecording
+
+if typing.TYPE_CHECKING:
+    from vrcar.client.decoder import Drawable
+
+logger = logging.getLogger(__name__)
+
+
+class Playback(threading.Thread):
+    """Feed the frames of a video recording to the decoder like `Camera`
+
+    Frames are submitted at their recorded timing divided by `speed`. If
+    `speed` is zero, each frame is submitted once the previous one has
+    been decoded, so none are skipped. Playback starts at the keyframe
+    before `start` seconds into the recording.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        providers: list[Drawable],
+        speed: float = 1.0,
+        start: float = 0.0,
+    ):
+        self._recording = VideoRecording(path)
+        self._pool = BufferPool(3)
+        self._decoder = Decoder(providers, self._pool)
+        self.speed = speed
+        self._first = self._recording.seek(self._recording.timestamp(0) + start)
+        self.received = 0
+        super().__init__(daemon=True)
+
+    def _wait_decoded(self):
+        self._decoder.wait_finished(self.received)
+
+    def run(self):
+        self._decoder.start()
+        recording = self._recording
+        logger.info(
+            f"Playing {len(recording) - self._first} frames"
+            f" from frame {self._first} at {self.speed:g}x speed"
+        )
+
+        origin = recording.timestamp(self._first)
+        start = time.perf_counter()
+        try:
+            for index in range(self._first, len(recording)):
+                frame = recording[index]
+                if self.speed:
+                    delay = (
+                        start + (frame.timestamp - origin) / self.speed
+                    ) - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                else:
+                    self._wait_decoded()
+
+                length = len(frame.data)
+                buffer = self._pool.acquire(length)
+                buffer[:length] = frame.data
+                frame.data.release()
+
+                # time the local pipeline only, the recording is from the past
+                now = time.time()
+                timing = latency.stats.frame(frame.sequence, now, now, now)
+                latency.stats.received(timing)
+                self._decoder.submit(buffer, length, timing)
+                self.received += 1
+        finally:
+            recording.close()
+
+        elapsed = time.perf_counter() - start
+        logger.info(
+            f"Played {self.received} frames in {elapsed:.1f}s,"
+            f" {self.received / elapsed if elapsed else 0.0:.1f} fps"
+        )
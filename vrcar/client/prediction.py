@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import collections
+import logging
+import math
+import statistics
+import time
+
+logger = logging.getLogger(__name__)
+
+# quaternions are (x, y, z, w) like `xr.Quaternionf`
+Quaternion = tuple[float, float, float, float]
+Vector = tuple[float, float, float]
+
+
+def multiply(a: Quaternion, b: Quaternion) -> Quaternion:
+    ax, ay, az, aw = a
+    bx, by, bz, bw = b
+    return (
+        aw * bx + ax * bw + ay * bz - az * by,
+        aw * by - ax * bz + ay * bw + az * bx,
+        aw * bz + ax * by - ay * bx + az * bw,
+        aw * bw - ax * bx - ay * by - az * bz,
+    )
+
+
+def integrate(
+    orientation: Quaternion, angular_velocity: Vector, seconds: float
+) -> Quaternion:
+    """Rotate `orientation` at `angular_velocity` for `seconds`
+
+    The angular velocity is in radians per second around the axes of the
+    base space, as reported by `xrLocateSpace`.
+    """
+    wx, wy, wz = angular_velocity
+    speed = math.sqrt(wx * wx + wy * wy + wz * wz)
+    angle = speed * seconds
+    if angle < 1e-9:
+        return orientation
+
+    scale = math.sin(angle / 2) / speed
+    delta = (wx * scale, wy * scale, wz * scale, math.cos(angle / 2))
+    x, y, z, w = multiply(delta, orientation)
+    norm = math.sqrt(x * x + y * y + z * z + w * w)
+    return x / norm, y / norm, z / norm, w / norm
+
+
+def angle_between(a: Quaternion, b: Quaternion) -> float:
+    """Get the rotation between two orientations in degrees"""
+    dot = abs(sum(x * y for x, y in zip(a, b)))
+    return math.degrees(2 * math.acos(min(dot, 1.0)))
+
+
+class HeadPredictor:
+    """Extrapolate the head orientation `horizon` seconds into the future
+
+    Each prediction is later compared against the orientation actually
+    reached at its target time. The error is logged next to the error of
+    sending the unpredicted orientation, which shows whether the horizon
+    helps or overshoots.
+    """
+
+    REPORT_INTERVAL = 10.0
+
+    def __init__(self, horizon: float):
+        self.horizon = horizon
+        # target time, predicted and unpredicted orientation
+        self._pending: collections.deque[tuple[float, Quaternion, Quaternion]] = (
+            collections.deque()
+        )
+        self._errors: list[float] = []
+        self._raw_errors: list[float] = []
+        self._next_report = time.monotonic() + self.REPORT_INTERVAL
+
+    def predict(
+        self,
+        timestamp: float,
+        orientation: Quaternion,
+        angular_velocity: Vector | None,
+    ) -> Quaternion:
+        """Predict the orientation from a sample at `timestamp` seconds"""
+        if not self.horizon:
+            return orientation
+
+        self._evaluate(timestamp, orientation)
+        predicted = orientation
+        if angular_velocity is not None:
+            predicted = integrate(orientation, angular_velocity, self.horizon)
+
+        self._pending.append((timestamp + self.horizon, predicted, orientation))
+        return predicted
+
+    def _evaluate(self, timestamp: float, orientation: Quaternion):
+        pending = self._pending
+        while pending and pending[0][0] <= timestamp:
+            _, predicted, raw = pending.popleft()
+            self._errors.append(angle_between(predicted, orientation))
+            self._raw_errors.append(angle_between(raw, orientation))
+
+        if time.monotonic() >= self._next_report:
+            self._next_report = time.monotonic() + self.REPORT_INTERVAL
+            self.report()
+
+    def report(self):
+        errors, self._errors = sorted(self._errors), []
+        raw_errors, self._raw_errors = sorted(self._raw_errors), []
+        if not errors:
+            return
+
+        p95 = int(len(errors) * 0.95)
+        logger.info(
+            f"Head prediction error at {self.horizon * 1000:.0f}ms:"
+            f" mean={statistics.fmean(errors):.2f}° p95={errors[p95]:.2f}°,"
+            f" unpredicted mean={statistics.fmean(raw_errors):.2f}°"
+            f" p95={raw_errors[p95]:.2f}°"
+        )
@@ -1,30 +1,31 @@
 from __future__ import annotations
 
+import ctypes
 import importlib.resources
 import importlib.util
 import logging
 import threading
+import time
 import typing
 
 try:
     import xr
     from OpenGL import GL
-    from OpenGL.GL import shaders
-    from PIL import Image
 except ImportError:
     xr: typing.Any
     GL: typing.Any
-    Image: typing.Any
-    shaders: typing.Any
 
 import vrcar
+from vrcar.client import latency
+from vrcar.client.prediction import HeadPredictor
+from vrcar.client.provider.openxr.program import load_program
 from vrcar.common import CAM_HEIGHT, CAM_WIDTH, Commands
 
 if typing.TYPE_CHECKING:
-    import io
+    from vrcar.client.latency import FrameTiming
 
 logger = logging.getLogger(__name__)
-resources = importlib.resources.files()
+resources = importlib.resources.files(__name__)
 
 
 class OpenXRProvider:
@@ -49,31 +50,41 @@ class OpenXRProvider:
             view_configuration_type=xr.ViewConfigurationType.PRIMARY_STEREO,
         )
 
+    UPLOAD_STATS_INTERVAL = 300
+    # how far ahead to predict the head orientation for the camera servos,
+    # should roughly match the latency from sending controls to display
+    prediction_horizon = 0.1
+
     def __enter__(self):
         self._context.__enter__()
         self._frame_loop = iter(self._context.frame_loop())
-        self._new_data = None
-        self._new_data_lock = threading.Lock()
+        self._upload_lock = threading.Lock()
+        self._new_frame = False
+        self._new_frame_timing: FrameTiming | None = None
+        self._new_frame_size = (CAM_WIDTH, CAM_HEIGHT)
+        # part of the texture covered by the current frame
+        self._scale = (1.0, 1.0)
 
         instance_props = xr.get_instance_properties(self._context.instance)
         runtime_name = instance_props.runtime_name.decode()
         logger.info(f"Using VR runtime: {runtime_name}")
 
-        self._texture = GL.glGenTextures(1)
+        self._setup_texture()
 
-        vertex_shader_data = resources.joinpath("plane.vert").read_text()
-        fragment_shader_data = resources.joinpath("plane.frag").read_text()
+        self._view_space = xr.create_reference_space(
+            session=self._context.session,
+            create_info=xr.ReferenceSpaceCreateInfo(
+                reference_space_type=xr.ReferenceSpaceType.VIEW,
+            ),
+        )
+        self._velocity = xr.SpaceVelocity()
+        self._location = xr.SpaceLocation(next=ctypes.pointer(self._velocity))
+        self._predictor = HeadPredictor(self.prediction_horizon)
 
-        try:
-            vertex_shader = shaders.compileShader(
-                vertex_shader_data, GL.GL_VERTEX_SHADER
-            )
-            fragment_shader = shaders.compileShader(
-                fragment_shader_data, GL.GL_FRAGMENT_SHADER
-            )
-        except shaders.ShaderCompilationError as e:
-            raise ValueError(e.args[0]) from None
-        self._shader = shaders.compileProgram(vertex_shader, fragment_shader)
+        self._shader = load_program(
+            resources.joinpath("plane.vert").read_text(),
+            resources.joinpath("plane.frag").read_text(),
+        )
 
         self._vertices = GL.glGenVertexArrays(1)
         GL.glBindVertexArray(self._vertices)
@@ -86,23 +97,20 @@ class OpenXRProvider:
         return self
 
     def __exit__(self, *args):
-        self._context.__exit__(*args)
-
-    def draw(self, buffer: io.BytesIO):
-        image = Image.open(buffer)
-        image = image.resize((CAM_WIDTH, CAM_HEIGHT))
-        with self._new_data_lock:
-            self._new_data = image.tobytes("raw", "RGB")
+        with self._upload_lock:
+            self._mapped = None
+            GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, self._pbos[self._pbo_index])
+            GL.glUnmapBuffer(GL.GL_PIXEL_UNPACK_BUFFER)
+            GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, 0)
 
-    def update_texture(self):
-        with self._new_data_lock:
-            if not self._new_data:
-                return
-
-            data = self._new_data
-            self._new_data = None
+        xr.destroy_space(self._view_space)
+        self._context.__exit__(*args)
 
+    def _setup_texture(self):
+        # immutable storage, allocated once and updated with glTexSubImage2D
+        self._texture = GL.glGenTextures(1)
         GL.glBindTexture(GL.GL_TEXTURE_2D, self._texture)
+        GL.glTexStorage2D(GL.GL_TEXTURE_2D, 1, GL.GL_RGBA8, CAM_WIDTH, CAM_HEIGHT)
         GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST)
         GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_NEAREST)
         GL.glTexParameteri(
@@ -112,18 +120,87 @@ class OpenXRProvider:
             GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_BORDER
         )
         GL.glTexParameterfv(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_BORDER_COLOR, (1, 1, 1, 1))
+        GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)
 
-        GL.glTexImage2D(
-            GL.GL_TEXTURE_2D,
-            0,
-            GL.GL_RGBA,
-            CAM_WIDTH,
-            CAM_HEIGHT,
+        # two pixel buffers: one is filled by the camera thread
+        # while the GPU uploads from the other one
+        self._pbo_size = CAM_WIDTH * CAM_HEIGHT * 3
+        self._pbos = GL.glGenBuffers(2)
+        for pbo in self._pbos:
+            GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, pbo)
+            GL.glBufferData(
+                GL.GL_PIXEL_UNPACK_BUFFER, self._pbo_size, None, GL.GL_STREAM_DRAW
+            )
+
+        self._pbo_index = 0
+        self._mapped = self._map_pbo(self._pbos[0])
+        GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, 0)
+
+        self.uploads = 0
+        self.upload_time = 0.0
+
+    def _map_pbo(self, pbo) -> memoryview:
+        GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, pbo)
+        pointer = GL.glMapBufferRange(
+            GL.GL_PIXEL_UNPACK_BUFFER,
             0,
-            GL.GL_RGB,
-            GL.GL_UNSIGNED_BYTE,
-            data,
+            self._pbo_size,
+            GL.GL_MAP_WRITE_BIT | GL.GL_MAP_INVALIDATE_BUFFER_BIT,
         )
+        array = (ctypes.c_ubyte * self._pbo_size).from_address(pointer)
+        return memoryview(array).cast("B")
+
+    def draw(self, frame: memoryview, size: tuple[int, int], timing: FrameTiming):
+        with self._upload_lock:
+            if self._mapped is None or len(frame) > len(self._mapped):
+                return
+
+            self._mapped[: len(frame)] = frame
+            self._new_frame = True
+            self._new_frame_timing = timing
+            self._new_frame_size = size
+
+    def update_texture(self):
+        with self._upload_lock:
+            if not self._new_frame:
+                return
+
+            self._new_frame = False
+            timing = self._new_frame_timing
+            width, height = self._new_frame_size
+            start = time.perf_counter()
+
+            self._mapped = None
+            GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, self._pbos[self._pbo_index])
+            GL.glUnmapBuffer(GL.GL_PIXEL_UNPACK_BUFFER)
+
+            GL.glBindTexture(GL.GL_TEXTURE_2D, self._texture)
+            GL.glTexSubImage2D(
+                GL.GL_TEXTURE_2D,
+                0,
+                0,
+                0,
+                width,
+                height,
+                GL.GL_RGB,
+                GL.GL_UNSIGNED_BYTE,
+                ctypes.c_void_p(0),
+            )
+
+            self._pbo_index ^= 1
+            self._mapped = self._map_pbo(self._pbos[self._pbo_index])
+            GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, 0)
+            # smaller frames are scaled up while sampling
+            self._scale = (width / CAM_WIDTH, height / CAM_HEIGHT)
+
+        latency.stats.displayed(timing)
+        self.upload_time += time.perf_counter() - start
+        self.uploads += 1
+        if self.uploads == self.UPLOAD_STATS_INTERVAL:
+            average = self.upload_time / self.uploads * 1000
+            logger.debug(f"Texture upload: {average:.3f}ms average")
+            self.uploads = 0
+            self.upload_time = 0.0
 
     def update(self, state: dict[Commands, float]) -> bool:
         frame_data = next(self._frame_loop, None)
@@ -131,20 +208,58 @@ class OpenXRProvider:
             return False
 
         self.update_texture()
+        located = self._update_head(frame_data.predicted_display_time, state)
 
         for index, view in enumerate(self._context.view_loop(frame_data)):
-            state[Commands.HEAD_H] = view.pose.orientation.y
-            state[Commands.HEAD_V] = view.pose.orientation.x
+            if not located:
+                state[Commands.HEAD_H] = view.pose.orientation.y
+                state[Commands.HEAD_V] = view.pose.orientation.x
 
             GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
             GL.glUseProgram(self._shader)
             GL.glUniform1f(0, index)
+            GL.glUniform2f(1, *self._scale)
             GL.glBindVertexArray(self._vertices)
             GL.glBindTexture(GL.GL_TEXTURE_2D, self._texture)
             GL.glDrawArrays(GL.GL_TRIANGLES, 0, 6)
 
         return True
 
+    def _update_head(self, display_time: int, state: dict[Commands, float]) -> bool:
+        """Set the predicted head orientation, returning `False` if untracked"""
+        # `xr.locate_space` does not allow chaining the velocity structure
+        result = xr.check_result(
+            xr.raw_functions.xrLocateSpace(
+                self._view_space,
+                self._context.space,
+                display_time,
+                ctypes.byref(self._location),
+            )
+        )
+        if result.is_exception():
+            raise result
+
+        if (
+            not self._location.location_flags
+            & xr.SpaceLocationFlags.ORIENTATION_VALID_BIT
+        ):
+            return False
+
+        orientation = self._location.pose.orientation
+        angular_velocity = None
+        if self._velocity.velocity_flags & xr.SpaceVelocityFlags.ANGULAR_VALID_BIT:
+            velocity = self._velocity.angular_velocity
+            angular_velocity = velocity.x, velocity.y, velocity.z
+
+        x, y, _, _ = self._predictor.predict(
+            display_time / 1e9,
+            (orientation.x, orientation.y, orientation.z, orientation.w),
+            angular_velocity,
+        )
+        state[Commands.HEAD_H] = y
+        state[Commands.HEAD_V] = x
+        return True
+
     def wait(self):
         pass
 
@@ -1,6 +1,8 @@
 #version 430
 
 layout(location = 0) uniform float Index = float(1);
+// part of the texture covered by the frame
+layout(location = 1) uniform vec2 Scale = vec2(1.0, 1.0);
 out vec2 texCoord;
 
 const vec2 VERTICES[4] = vec2[4](
@@ -19,7 +21,7 @@ void main() {
   int vertexIndex = INDICES[gl_VertexID];
 
   vec2 vertex = VERTICES[vertexIndex];
-  texCoord = vec2(vertex.x, 1.0 - vertex.y);
+  texCoord = vec2(vertex.x, 1.0 - vertex.y) * Scale;
 
   // Scale as -1.0 - 1.0 device
   // HACK: overall offset - eye distance
@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import ctypes
+import hashlib
+import logging
+import os
+import struct
+import typing
+
+try:
+    from OpenGL import GL
+    from OpenGL.error import GLError
+except ImportError:
+    GL: typing.Any
+    GLError: typing.Any
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIRECTORY = "cache/programs"
+# binary format in front of the program binary
+format_struct = struct.Struct("<I")
+
+
+def _cache_path(*sources: str) -> str:
+    """Get the cache file for `sources` on the current driver"""
+    digest = hashlib.sha256()
+    for name in (GL.GL_VENDOR, GL.GL_RENDERER, GL.GL_VERSION):
+        digest.update(GL.glGetString(name) or b"")
+    for source in sources:
+        digest.update(source.encode())
+
+    return os.path.join(CACHE_DIRECTORY, f"{digest.hexdigest()}.bin")
+
+
+def _compile(shader_type: int, source: str) -> int:
+    shader = GL.glCreateShader(shader_type)
+    GL.glShaderSource(shader, source)
+    GL.glCompileShader(shader)
+    if not GL.glGetShaderiv(shader, GL.GL_COMPILE_STATUS):
+        log = GL.glGetShaderInfoLog(shader)
+        GL.glDeleteShader(shader)
+        raise ValueError(log.decode() if isinstance(log, bytes) else log)
+
+    return shader
+
+
+def _link(vertex: str, fragment: str, retrievable: bool = False) -> int:
+    shaders = [
+        _compile(GL.GL_VERTEX_SHADER, vertex),
+        _compile(GL.GL_FRAGMENT_SHADER, fragment),
+    ]
+    program = GL.glCreateProgram()
+    if retrievable:
+        GL.glProgramParameteri(
+            program, GL.GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL.GL_TRUE
+        )
+    for shader in shaders:
+        GL.glAttachShader(program, shader)
+    GL.glLinkProgram(program)
+    for shader in shaders:
+        GL.glDetachShader(program, shader)
+        GL.glDeleteShader(shader)
+
+    if not GL.glGetProgramiv(program, GL.GL_LINK_STATUS):
+        log = GL.glGetProgramInfoLog(program)
+        GL.glDeleteProgram(program)
+        raise ValueError(log.decode() if isinstance(log, bytes) else log)
+
+    return program
+
+
+def _load_binary(path: str) -> int | None:
+    try:
+        with open(path, "rb") as file:
+            data = file.read()
+    except FileNotFoundError:
+        return None
+    if len(data) <= format_struct.size:
+        return None
+
+    (binary_format,) = format_struct.unpack_from(data)
+    binary = data[format_struct.size :]
+    program = GL.glCreateProgram()
+    try:
+        GL.glProgramBinary(
+            program,
+            binary_format,
+            (ctypes.c_ubyte * len(binary)).from_buffer_copy(binary),
+            len(binary),
+        )
+        linked = GL.glGetProgramiv(program, GL.GL_LINK_STATUS)
+    except GLError:
+        linked = False
+
+    if not linked:
+        # drivers reject binaries of other driver versions
+        logger.info("Cached shader program was rejected, compiling")
+        GL.glDeleteProgram(program)
+        return None
+
+    return program
+
+
+def _save_binary(path: str, program: int):
+    size = int(GL.glGetProgramiv(program, GL.GL_PROGRAM_BINARY_LENGTH))
+    if not size:
+        return
+
+    binary = (ctypes.c_ubyte * size)()
+    length = (GL.GLsizei * 1)()
+    binary_format = (GL.GLenum * 1)()
+    GL.glGetProgramBinary(program, size, length, binary_format, binary)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # write a new file and rename it, so readers never see a partial file
+    with open(f"{path}.tmp", "wb") as file:
+        file.write(format_struct.pack(binary_format[0]))
+        file.write(memoryview(binary)[: length[0]])
+    os.replace(f"{path}.tmp", path)
+
+
+def load_program(vertex: str, fragment: str) -> int:
+    """Link a program from shader sources, using a cached binary if possible
+
+    Binaries are cached per driver and shader sources, and rebuilt from
+    source whenever the driver rejects them.
+    """
+    if not GL.glGetIntegerv(GL.GL_NUM_PROGRAM_BINARY_FORMATS):
+        return _link(vertex, fragment)
+
+    path = _cache_path(vertex, fragment)
+    program = _load_binary(path)
+    if program is not None:
+        logger.debug(f"Loaded shader program from {path}")
+        return program
+
+    program = _link(vertex, fragment, retrievable=True)
+    try:
+        _save_binary(path, program)
+    except (OSError, GLError) as error:
+        logger.warning(f"Failed to cache shader program: {error}")
+
+    return program
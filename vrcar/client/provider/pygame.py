@@ -14,10 +14,11 @@ except ImportError:
     pygame: typing.Any
 
 import vrcar
+from vrcar.client import latency
 from vrcar.common import CAM_HEIGHT, CAM_WIDTH, Commands
 
 if typing.TYPE_CHECKING:
-    import io
+    from vrcar.client.latency import FrameTiming
 
 logger = logging.getLogger(__name__)
 
@@ -25,8 +26,12 @@ logger = logging.getLogger(__name__)
 class PygameProvider:
     available = importlib.util.find_spec("pygame") is not None
 
+    # input sampling and drawing rate, above the usual control rates
+    UPDATE_RATE = 120
+
     def __init__(self):
         self.sticks = []
+        self._timing: FrameTiming | None = None
 
     def __enter__(self):
         pygame.display.init()
@@ -34,6 +39,7 @@ class PygameProvider:
         pygame.display.set_caption(vrcar.__name__)
 
         self._display = pygame.display.set_mode((CAM_WIDTH, CAM_HEIGHT))
+        self._clock = pygame.time.Clock()
 
         for index in range(pygame.joystick.get_count()):
             stick = pygame.joystick.Joystick(index)
@@ -47,9 +53,13 @@ class PygameProvider:
     def __exit__(self, *_):
         pygame.quit()
 
-    def draw(self, buffer: io.BytesIO):
-        image = pygame.image.load(buffer)
+    def draw(self, frame: memoryview, size: tuple[int, int], timing: FrameTiming):
+        image = pygame.image.frombuffer(frame, size, "RGB")
+        # lower quality presets send smaller frames
+        if size != self._display.get_size():
+            image = pygame.transform.scale(image, self._display.get_size())
         self._display.blit(image, (0, 0))
+        self._timing = timing
 
     def update(self, state: dict[Commands, float]) -> bool:
         for event in pygame.event.get():
@@ -99,8 +109,10 @@ class PygameProvider:
                     state[Commands.TURN] = value
 
         pygame.display.flip()
+        # counted once, even if the same frame is flipped again
+        latency.stats.displayed(self._timing)
 
         return True
 
     def wait(self):
-        pygame.time.wait(100)
+        self._clock.tick(self.UPDATE_RATE)
@@ -2,7 +2,9 @@ from __future__ import annotations
 
 import contextlib
 import enum
+import socket
 import struct
+import typing
 
 CAM_WIDTH, CAM_HEIGHT = 1024, 768
 
@@ -20,3 +22,42 @@ class Commands(enum.Enum):
 
 
 float_struct = struct.Struct("f")
+
+# Sent by the client as the first byte to select fixed-size state frames
+# instead of the legacy opcode-per-field commands
+FRAME_HANDSHAKE = b"\x80"
+# sequence, timestamp, move, strafe, turn, head_h, head_v, flags
+frame_struct = struct.Struct("!Idfff3B")
+# frame flag asking the server to acknowledge the frame once applied
+FRAME_ACK = 0b0000_0001
+# sequence and timestamp of the acknowledged frame
+ack_struct = struct.Struct("!Id")
+
+# Camera stream frame header:
+# length, sequence, capture time, send time, and the echoed client send time
+# of the last feedback along with its server receive time (zero if none)
+frame_header_struct = struct.Struct("!IIdddd")
+# Camera stream feedback from the client:
+# frames received, frames skipped, average decode time and send time
+feedback_struct = struct.Struct("!IIfd")
+
+
+class Frame(typing.NamedTuple):
+    """An encoded camera frame, as served live or read from a recording"""
+
+    data: memoryview
+    sequence: int
+    keyframe: bool
+    # capture time as UNIX timestamp
+    timestamp: float
+
+
+def recv_exact(sock: socket.socket, view: memoryview) -> bool:
+    """Fill `view` completely from `sock`, returning `False` on EOF"""
+    while view:
+        count = sock.recv_into(view, 0, socket.MSG_WAITALL)
+        if not count:
+            return False
+        view = view[count:]
+
+    return True
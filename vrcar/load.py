@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import contextlib
+import json
+import logging
+import socket
+import threading
+import time
+import typing
+
+from vrcar.client.controls import Controls, ControlScheduler
+from vrcar.client.latency import Histogram, LatencyStats
+from vrcar.common import feedback_struct, frame_header_struct, recv_exact
+
+logger = logging.getLogger(__name__)
+
+
+class CameraLoad(threading.Thread):
+    """Camera client receiving frames without decoding them"""
+
+    FEEDBACK_INTERVAL = 1.0
+
+    def __init__(self, address: tuple[str, int]):
+        self.connected = time.time()
+        self._socket = socket.create_connection(address)
+        self._stopped = threading.Event()
+        self.latency = LatencyStats()
+        self.frames = 0
+        self.bytes = 0
+        self.first_frame: float | None = None
+        self.last_frame = 0.0
+        super().__init__(daemon=True)
+
+    def stop(self):
+        self._stopped.set()
+        with contextlib.suppress(OSError):
+            self._socket.shutdown(socket.SHUT_RDWR)
+        self.join()
+
+    def run(self):
+        header = bytearray(frame_header_struct.size)
+        header_view = memoryview(header)
+        buffer = bytearray(256 * 1024)
+        next_feedback = time.monotonic()
+        reported = 0
+
+        try:
+            while recv_exact(self._socket, header_view):
+                length, sequence, captured, sent, echo_sent, echo_received = (
+                    frame_header_struct.unpack(header)
+                )
+                if echo_sent:
+                    self.latency.sync(echo_sent, echo_received, sent)
+
+                if len(buffer) < length:
+                    buffer = bytearray(length)
+                with memoryview(buffer) as view, view[:length] as frame:
+                    if not recv_exact(self._socket, frame):
+                        break
+
+                now = time.time()
+                timing = self.latency.frame(sequence, captured, sent, now)
+                self.latency.received(timing)
+                self.latency.record("total", now - timing.captured)
+                if self.first_frame is None:
+                    self.first_frame = now
+                self.last_frame = now
+                self.frames += 1
+                self.bytes += length
+
+                # feedback lets the server echo timestamps for clock sync
+                if time.monotonic() >= next_feedback:
+                    next_feedback = time.monotonic() + self.FEEDBACK_INTERVAL
+                    # like the client, report the frames since the last feedback
+                    received, reported = self.frames - reported, self.frames
+                    self._socket.sendall(
+                        feedback_struct.pack(received, 0, 0.0, time.time())
+                    )
+        except OSError:
+            if not self._stopped.is_set():
+                raise
+        finally:
+            self._socket.close()
+
+    def result(self) -> dict[str, typing.Any]:
+        elapsed = self.last_frame - (self.first_frame or self.last_frame)
+        total = self.latency.total["total"]
+        return {
+            "frames": self.frames,
+            "first_frame_ms": (
+                (self.first_frame - self.connected) * 1000 if self.first_frame else None
+            ),
+            "fps": (self.frames - 1) / elapsed if elapsed else 0.0,
+            "mb_per_s": self.bytes / elapsed / 1e6 if elapsed else 0.0,
+            "latency_ms": _percentiles(total),
+            "clock_offset_ms": self.latency.offset * 1000,
+        }
+
+
+class ControlsLoad:
+    """Controls client sending state frames at a fixed rate"""
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        rate: float,
+        udp: bool,
+        impairment: tuple[float, float, float] | None = None,
+    ):
+        self._controls = Controls(address, [], udp=udp, impairment=impairment)
+        self._scheduler = ControlScheduler(self._controls, rate)
+
+    def start(self):
+        self._scheduler.start()
+
+    def stop(self):
+        self._scheduler.stop()
+
+    def result(self) -> dict[str, typing.Any]:
+        controls = self._controls
+        scheduler = self._scheduler
+        impairment = controls.impairment
+        return {
+            "sent": controls.sent,
+            "lost": impairment.dropped if impairment else 0,
+            "acked": controls.rtt.count,
+            "rtt_ms": _percentiles(controls.rtt),
+            "missed_ticks": scheduler.missed,
+            "jitter_ms": _percentiles(scheduler.jitter),
+        }
+
+
+def _percentiles(histogram: Histogram) -> dict[str, float]:
+    return {f"p{percent}": histogram.percentile(percent) for percent in (50, 95, 99)}
+
+
+def run(
+    address: str,
+    camera_port: int,
+    controls_port: int,
+    camera_clients: int = 1,
+    controls_clients: int = 1,
+    rate: float = 60.0,
+    udp_controls: bool = False,
+    duration: float = 10.0,
+    impairment: tuple[float, float, float] | None = None,
+) -> dict[str, typing.Any]:
+    """Run clients against a server for `duration` seconds and collect stats
+
+    `impairment` is the loss, delay and jitter injected into UDP controls.
+    """
+    cameras = [CameraLoad((address, camera_port)) for _ in range(camera_clients)]
+    controls = [
+        ControlsLoad((address, controls_port), rate, udp_controls, impairment)
+        for _ in range(controls_clients)
+    ]
+    clients: list[CameraLoad | ControlsLoad] = [*cameras, *controls]
+
+    logger.info(
+        f"Running {camera_clients} camera and {controls_clients} controls"
+        f" clients for {duration:.0f}s"
+    )
+    for client in clients:
+        client.start()
+    time.sleep(duration)
+    for client in clients:
+        client.stop()
+
+    return {
+        "duration": duration,
+        "camera": [camera.result() for camera in cameras],
+        "controls": [control.result() for control in controls],
+    }
+
+
+def main(
+    address: str,
+    camera_port: int,
+    controls_port: int,
+    output: str | None = None,
+    **kwargs,
+):
+    results = json.dumps(
+        run(address, camera_port, controls_port, **kwargs),
+        indent=2,
+    )
+    if output is None:
+        print(results)
+        return
+
+    with open(output, "w", encoding="utf8") as file:
+        file.write(results)
+    logger.info(f"Wrote load results to {output}")
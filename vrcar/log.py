@@ -1,7 +1,13 @@
 from __future__ import annotations
 
+import atexit
+import bisect
 import logging
+import logging.handlers
+import queue
 import sys
+import threading
+import time
 from collections.abc import Mapping
 from datetime import datetime
 from pathlib import Path
@@ -26,8 +32,8 @@ class PrettyFormatter(logging.Formatter):
         logging.DEBUG: "\x1b[36;1m",
         logging.INFO: "\x1b[34;1m",
         logging.WARNING: "\x1b[33;1m",
-        logging.ERROR: "\x1b[31m;1",
-        logging.CRITICAL: "\x1b[41m;1",
+        logging.ERROR: "\x1b[31;1m",
+        logging.CRITICAL: "\x1b[41;1m",
     }
 
     def __init__(
@@ -43,13 +49,41 @@ class PrettyFormatter(logging.Formatter):
         self._log_format = self._log_format.replace("{name_length}", str(name_length))
         super().__init__(self._log_format, style="{", datefmt="%Y-%m-%d %H:%M:%S")
 
+        # per level templates with everything but the record specific fields
+        # filled in, so formatting a record is a single `str.format` call
+        self._templates: dict[int, str] = {}
+        self._last_second = -1
+        self._last_asctime = ""
+
+    def _template(self, levelno: int, levelname: str) -> str:
+        template = self._log_format
+        for field, value in (
+            ("{level_color}", self.LEVEL_COLORS.get(levelno, "")),
+            ("{record.levelname:<8}", f"{levelname:<8}"),
+            ("{record.asctime}", "{0}"),
+            ("{record.msecs:03.0f}", "{1:03.0f}"),
+            ("{record.name:", "{2:"),
+            ("{record.message}", "{3}"),
+        ):
+            template = template.replace(field, value)
+
+        self._templates[levelno] = template
+        return template
+
     def format(self, /, record: logging.LogRecord) -> str:
-        record.asctime = self.formatTime(record, self.datefmt)
+        # the timestamp only changes once per second
+        second = int(record.created)
+        if second != self._last_second:
+            self._last_second = second
+            self._last_asctime = self.formatTime(record, self.datefmt)
+        record.asctime = self._last_asctime
         record.message = record.getMessage()
 
-        output = self._log_format.format(
-            record=record,
-            level_color=self.LEVEL_COLORS[record.levelno],
+        template = self._templates.get(record.levelno)
+        if template is None:
+            template = self._template(record.levelno, record.levelname)
+        output = template.format(
+            record.asctime, record.msecs, record.name, record.message
         )
 
         if record.exc_info and not record.exc_text:
@@ -68,22 +102,183 @@ class PrettyFormatter(logging.Formatter):
         return output
 
 
-def setup(name_length: int = 20, debug: bool = False):
+class RateLimited:
+    """Log at most one message per `interval` seconds to `logger`
+
+    Meant for messages that could be logged per frame or per command.
+    The number of suppressed messages is added to the next one let through.
+    """
+
+    def __init__(self, logger: logging.Logger, interval: float = 1.0):
+        self._logger = logger
+        self.interval = interval
+        self._next = 0.0
+        self._suppressed = 0
+        self._lock = threading.Lock()
+
+    def log(self, level: int, msg: str, *args):
+        if not self._logger.isEnabledFor(level):
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next:
+                self._suppressed += 1
+                return
+
+            self._next = now + self.interval
+            suppressed, self._suppressed = self._suppressed, 0
+
+        if suppressed:
+            msg = f"{msg} ({suppressed} similar messages suppressed)"
+        self._logger.log(level, msg, *args, stacklevel=3)
+
+    def debug(self, msg: str, *args):
+        self.log(logging.DEBUG, msg, *args)
+
+    def info(self, msg: str, *args):
+        self.log(logging.INFO, msg, *args)
+
+    def warning(self, msg: str, *args):
+        self.log(logging.WARNING, msg, *args)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """Hand records to a `QueueListener` without formatting them first
+
+    The records never leave the process, so all formatting can happen on
+    the listener thread instead of the logging thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def _sessions(directory: Path) -> list[tuple[float, list[Path]]]:
+    """Group the files in `directory` by session, newest first
+
+    A session is a log with its rotated parts and the latency dumps written
+    while it ran, and comes with the newest modification time of its files.
+    The timestamps in the names sort chronologically.
+    """
+    sessions: dict[str, list[Path]] = {}
+    for path in directory.glob("*.log*"):
+        sessions.setdefault(path.name.partition(".log")[0], []).append(path)
+
+    starts = sorted(sessions)
+    for path in directory.glob("latency_*.json"):
+        stamp = path.stem.removeprefix("latency_")
+        index = bisect.bisect_right(starts, stamp) - 1
+        start = starts[index] if index >= 0 else stamp
+        sessions.setdefault(start, []).append(path)
+
+    return sorted(
+        (
+            (max(path.stat().st_mtime for path in paths), paths)
+            for paths in sessions.values()
+        ),
+        key=lambda session: session[0],
+        reverse=True,
+    )
+
+
+def cleanup(directory: Path, max_files: int, max_age: float):
+    """Delete all but the newest `max_files` sessions and those older than `max_age`"""
+    oldest = time.time() - max_age
+    for index, (modified, paths) in enumerate(_sessions(directory)):
+        if index >= max_files or modified < oldest:
+            for path in paths:
+                path.unlink(missing_ok=True)
+
+
+class SessionFileHandler(logging.handlers.RotatingFileHandler):
+    """Rotate after `max_bytes` or `interval` seconds, whichever comes first
+
+    Old sessions are cleaned up on every rollover, so retention also
+    applies to a process running for longer than `max_age`.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int,
+        backup_count: int,
+        interval: float,
+        max_files: int,
+        max_age: float,
+    ):
+        super().__init__(
+            path,
+            mode="a",
+            maxBytes=max_bytes,
+            backupCount=backup_count,
+            encoding="utf8",
+        )
+        self._interval = interval
+        self._rollover_at = time.monotonic() + interval
+        self._max_files = max_files
+        self._max_age = max_age
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if time.monotonic() >= self._rollover_at:
+            return True
+
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self):
+        super().doRollover()
+        self._rollover_at = time.monotonic() + self._interval
+        # the current session is the newest one, so it is always kept
+        cleanup(Path(self.baseFilename).parent, self._max_files, self._max_age)
+
+
+def setup(
+    name_length: int = 20,
+    debug: bool = False,
+    max_bytes: int = 10 * 1024 * 1024,
+    backup_count: int = 3,
+    rotate_interval: float = 24 * 60 * 60,
+    max_files: int = 20,
+    max_age: float = 14 * 24 * 60 * 60,
+) -> logging.handlers.QueueListener:
+    """Log to the terminal and a new file in `logs/` from a background thread
+
+    The file is rotated after `max_bytes` or `rotate_interval` seconds,
+    keeping `backup_count` old parts. Older sessions beyond `max_files` or
+    `max_age` seconds are deleted at startup and on every rotation.
+    """
     current_name = datetime.now().strftime("logs/%Y-%m-%d_%H-%M-%S.log")
-    Path(current_name).parent.mkdir(parents=True, exist_ok=True)
+    directory = Path(current_name).parent
+    directory.mkdir(parents=True, exist_ok=True)
+    cleanup(directory, max_files - 1, max_age)
     level = logging.DEBUG if debug else logging.INFO
 
-    root_logger = logging.getLogger()
-    root_logger.setLevel(logging.DEBUG)
-
     formatter = PrettyFormatter(use_color=False, name_length=name_length)
-    handler = logging.FileHandler(current_name, mode="a", encoding="utf8")
-    handler.setFormatter(formatter)
-    handler.setLevel(level)
-    root_logger.addHandler(handler)
+    file_handler = SessionFileHandler(
+        current_name, max_bytes, backup_count, rotate_interval, max_files, max_age
+    )
+    file_handler.setFormatter(formatter)
+    file_handler.setLevel(level)
 
     formatter = PrettyFormatter(use_color=True, name_length=name_length)
-    handler = logging.StreamHandler(sys.stderr)
-    handler.setFormatter(formatter)
-    handler.setLevel(level)
-    root_logger.addHandler(handler)
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(formatter)
+    stream_handler.setLevel(level)
+
+    records: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(
+        records, file_handler, stream_handler, respect_handler_level=True
+    )
+    listener.start()
+    # flush everything still queued on exit
+    atexit.register(listener.stop)
+
+    # the formatters never show them, so skip looking them up for each record
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(level)
+    root_logger.addHandler(QueueHandler(records))
+
+    return listener
@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import json
+import logging
+import time
+import typing
+
+from vrcar.client.controls import Controls
+from vrcar.client.latency import Histogram
+from vrcar.telemetry import COMMAND, OUTPUT, Recording
+
+logger = logging.getLogger(__name__)
+
+# time to wait for the acknowledgements of the last commands
+ACK_GRACE = 0.5
+
+
+def _percentiles(histogram: Histogram) -> dict[str, float]:
+    return {f"p{percent}": histogram.percentile(percent) for percent in (50, 95, 99)}
+
+
+def run(
+    path: str,
+    address: str,
+    controls_port: int,
+    udp_controls: bool = False,
+    speed: float = 1.0,
+) -> dict[str, typing.Any]:
+    """Send the commands of a recording to a server as state frames
+
+    Commands are sent at their recorded arrival times divided by `speed`.
+    Commands recorded from the legacy protocol are sent as whole frames.
+    """
+    recording = Recording(path)
+    try:
+        commands = [record for record in recording if record.kind == COMMAND]
+        outputs = sum(record.kind == OUTPUT for record in recording)
+    finally:
+        recording.close()
+
+    if not commands:
+        raise ValueError(f"{path} contains no commands")
+
+    recorded = commands[-1].timestamp - commands[0].timestamp
+    logger.info(
+        f"Replaying {len(commands)} commands over {recorded:.1f}s"
+        f" at {speed:g}x speed"
+    )
+
+    controls = Controls((address, controls_port), [], udp=udp_controls)
+    lateness = Histogram(0.0001)
+    first = commands[0].timestamp
+    start = time.perf_counter()
+    for record in commands:
+        target = start + (record.timestamp - first) / speed
+        delay = target - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+        lateness.record(max(time.perf_counter() - target, 0.0))
+        controls.send_frame(
+            record.move, record.strafe, record.turn, record.head_h, record.head_v
+        )
+
+    elapsed = time.perf_counter() - start
+    time.sleep(ACK_GRACE)
+
+    return {
+        "commands": len(commands),
+        "recorded_outputs": outputs,
+        "recorded_duration": recorded,
+        "duration": elapsed,
+        "speed": speed,
+        "sent": controls.sent,
+        "acked": controls.rtt.count,
+        "rtt_ms": _percentiles(controls.rtt),
+        "lateness_ms": _percentiles(lateness),
+    }
+
+
+def main(
+    path: str,
+    address: str,
+    controls_port: int,
+    output: str | None = None,
+    **kwargs,
+):
+    results = json.dumps(run(path, address, controls_port, **kwargs), indent=2)
+    if output is None:
+        print(results)
+        return
+
+    with open(output, "w", encoding="utf8") as file:
+        file.write(results)
+    logger.info(f"Wrote replay results to {output}")
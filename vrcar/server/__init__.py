@@ -5,16 +5,132 @@ import os
 # Workaround for annoying libcamera logs
 os.environ["LIBCAMERA_LOG_LEVELS"] = "4"
 
-import concurrent.futures
+import asyncio
+import logging
+import typing
 
 from vrcar.common import suppress
-from vrcar.server import camera, controls
+from vrcar.timeline import timeline
+
+if typing.TYPE_CHECKING:
+    from vrcar.server.motors import MotorConfig
+    from vrcar.server.quality import Preset
+
+logger = logging.getLogger(__name__)
+
+SIMULATED_I2C_BITRATE = 100_000
+SIMULATED_I2C_HISTORY = 1024
+
+
+async def serve(
+    address: str,
+    camera_port: int,
+    controls_port: int,
+    udp_controls: bool = False,
+    failsafe_timeout: float = 0.5,
+    codec: str = "mjpeg",
+    adaptive_quality: bool = False,
+    simulate: bool = False,
+    preset: Preset | None = None,
+    bitrate: int = 0,
+    actuator_rate: float = 100.0,
+    servo_slew: float = 300.0,
+    motor_config: MotorConfig | None = None,
+    record: str | None = None,
+    record_video: str | None = None,
+    warm_camera: bool = False,
+):
+    from vrcar.server import camera, controls
+
+    tasks = [
+        asyncio.ensure_future(
+            camera.serve(
+                (address, camera_port),
+                codec,
+                adaptive_quality,
+                simulate,
+                preset,
+                bitrate,
+                record_video,
+                warm_camera,
+            )
+        ),
+        asyncio.ensure_future(
+            controls.serve(
+                (address, controls_port),
+                udp_controls,
+                failsafe_timeout,
+                actuator_rate,
+                servo_slew,
+                motor_config,
+                record,
+            )
+        ),
+    ]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if error := task.exception():
+                logger.error("Unexpected error", exc_info=error)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
 
 @suppress(KeyboardInterrupt)
-def run(address: str, camera_port: int, controls_port: int):
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        a = executor.submit(camera.run, (address, camera_port))
-        b = executor.submit(controls.run, (address, controls_port))
+def run(
+    address: str,
+    camera_port: int,
+    controls_port: int,
+    udp_controls: bool = False,
+    failsafe_timeout: float = 0.5,
+    codec: str = "mjpeg",
+    adaptive_quality: bool = False,
+    simulate: bool = False,
+    preset: Preset | None = None,
+    bitrate: int = 0,
+    actuator_rate: float = 100.0,
+    servo_slew: float = 300.0,
+    motor_config: MotorConfig | None = None,
+    record: str | None = None,
+    record_video: str | None = None,
+    warm_camera: bool = False,
+):
+    timeline.mark("server started")
+    bus = None
+    if simulate:
+        from vrcar.server.pwm import PCA9685, FakeSMBus
+
+        # simulate the transfer time of the I2C bus at standard mode speed
+        PCA9685.default_bus = bus = FakeSMBus(
+            bitrate=SIMULATED_I2C_BITRATE, history=SIMULATED_I2C_HISTORY
+        )
 
-        concurrent.futures.wait([a, b], return_when=concurrent.futures.FIRST_COMPLETED)
+    try:
+        asyncio.run(
+            serve(
+                address,
+                camera_port,
+                controls_port,
+                udp_controls,
+                failsafe_timeout,
+                codec,
+                adaptive_quality,
+                simulate,
+                preset,
+                bitrate,
+                actuator_rate,
+                servo_slew,
+                motor_config,
+                record,
+                record_video,
+                warm_camera,
+            )
+        )
+    finally:
+        if bus is not None:
+            logger.info(
+                f"Simulated I2C bus: {bus.transactions} transactions,"
+                f" {bus.busy_time * 1000:.1f}ms busy"
+            )
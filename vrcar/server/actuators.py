@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+import typing
+
+from vrcar.server.motors import MotorConfig, Motors
+from vrcar.server.servos import Servos
+
+if typing.TYPE_CHECKING:
+    from collections.abc import Callable
+
+    from vrcar.telemetry import Recorder
+
+logger = logging.getLogger(__name__)
+
+
+class Actuators(threading.Thread):
+    """Own the motors and servos and drive them at a fixed rate
+
+    Network loops only set targets, which never blocks on the I2C bus.
+    Each tick writes the latest motor target and moves the servos toward
+    their target angle by at most `slew_rate` degrees per second, so
+    network jitter does not turn into jerky camera motion. A `slew_rate`
+    of zero moves the servos to their target right away.
+
+    With a `recorder`, every command and every change of the PWM outputs
+    is recorded for later replay.
+    """
+
+    STATS_INTERVAL = 10.0
+    CENTER = 90.0
+
+    def __init__(
+        self,
+        rate: float = 100.0,
+        slew_rate: float = 300.0,
+        motor_config: MotorConfig | None = None,
+        recorder: Recorder | None = None,
+    ):
+        self.rate = rate
+        self.interval = 1 / rate
+        self.slew_rate = slew_rate
+        self._motor_config = motor_config
+        self._recorder = recorder
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.ready = threading.Event()
+        self.error: BaseException | None = None
+
+        self._drive = (0.0, 0.0, 0.0)
+        self._targets = [self.CENTER, self.CENTER]
+        # acknowledgements to send once the tick applying them is done
+        self._acks: list[tuple[Callable[[bytes], typing.Any], bytes]] = []
+
+        self.ticks = 0
+        self.overruns = 0
+        self._stats = self._new_stats()
+        super().__init__(name="actuators", daemon=True)
+
+    @staticmethod
+    def _new_stats() -> dict[str, float]:
+        return {"ticks": 0, "period": 0.0, "max_period": 0.0, "work": 0.0}
+
+    def drive(self, move: float, strafe: float, turn: float):
+        with self._lock:
+            self._drive = (move, strafe, turn)
+            if self._recorder is not None:
+                self._record_command(0, 0)
+
+    def head(self, channel: int, angle: int):
+        with self._lock:
+            self._targets[channel] = angle
+            if self._recorder is not None:
+                self._record_command(0, 0)
+
+    def update(
+        self,
+        move: float,
+        strafe: float,
+        turn: float,
+        head_h: int,
+        head_v: int,
+        ack: bytes | None = None,
+        send: Callable[[bytes], typing.Any] | None = None,
+        sequence: int = 0,
+        flags: int = 0,
+    ):
+        """Set all targets at once, calling `send(ack)` after the next tick"""
+        with self._lock:
+            self._drive = (move, strafe, turn)
+            self._targets[0] = head_h
+            self._targets[1] = head_v
+            if ack is not None and send is not None:
+                self._acks.append((send, ack))
+            if self._recorder is not None:
+                self._record_command(sequence, flags)
+
+    def _record_command(self, sequence: int, flags: int):
+        # called with the lock held, so the targets are consistent
+        self._recorder.command(
+            time.time(), sequence, flags, *self._drive, *map(round, self._targets)
+        )
+
+    def stop(self):
+        self.drive(0.0, 0.0, 0.0)
+
+    def close(self):
+        self._stopped.set()
+        self.join()
+
+    def run(self):
+        try:
+            motors = Motors(config=self._motor_config)
+            servos = Servos()
+        except BaseException as error:
+            self.error = error
+            raise
+        finally:
+            self.ready.set()
+
+        positions = [self.CENTER, self.CENTER]
+        written: list[int | None] = [None, None]
+        drive = None
+        recorder = self._recorder
+        # off values of the motor channels followed by the servo channels
+        duties = [0] * (Motors.CHANNEL_COUNT + len(positions))
+
+        try:
+            previous = time.perf_counter()
+            deadline = previous
+            while not self._stopped.is_set():
+                with self._lock:
+                    new_drive = self._drive
+                    targets = self._targets.copy()
+                    acks, self._acks = self._acks, []
+
+                start = time.perf_counter()
+                elapsed = start - previous
+                previous = start
+
+                changed = False
+                if new_drive != drive:
+                    drive = new_drive
+                    channels = motors.move(*drive)
+                    duties[: len(channels)] = [off for _, off in channels]
+                    changed = True
+
+                step = self.slew_rate * elapsed
+                for channel, target in enumerate(targets):
+                    position = positions[channel]
+                    if not self.slew_rate or abs(target - position) <= step:
+                        position = target
+                    elif target > position:
+                        position += step
+                    else:
+                        position -= step
+                    positions[channel] = position
+
+                    angle = round(position)
+                    if written[channel] != angle:
+                        written[channel] = angle
+                        duties[Motors.CHANNEL_COUNT + channel] = servos.set(
+                            channel, angle
+                        )
+                        changed = True
+
+                if changed and recorder is not None:
+                    recorder.output(time.time(), duties)
+
+                for send, ack in acks:
+                    send(ack)
+
+                self._stat(elapsed, time.perf_counter() - start)
+
+                deadline += self.interval
+                delay = deadline - time.perf_counter()
+                if delay > 0:
+                    self._stopped.wait(delay)
+                else:
+                    # a late tick runs right away to catch up
+                    self.overruns += 1
+                    if -delay >= self.interval:
+                        # a whole period was missed, skip ahead
+                        deadline = time.perf_counter()
+        finally:
+            motors.move(0, 0, 0)
+
+    def _stat(self, period: float, work: float):
+        self.ticks += 1
+        stats = self._stats
+        stats["ticks"] += 1
+        stats["period"] += period
+        stats["work"] += work
+        if period > stats["max_period"]:
+            stats["max_period"] = period
+
+        if stats["period"] >= self.STATS_INTERVAL:
+            self._stats = self._new_stats()
+            ticks = stats["ticks"]
+            logger.info(
+                f"Actuator loop: {ticks / stats['period']:.1f}Hz,"
+                f" period mean={stats['period'] / ticks * 1000:.2f}ms"
+                f" max={stats['max_period'] * 1000:.2f}ms,"
+                f" work mean={stats['work'] / ticks * 1000:.2f}ms,"
+                f" {self.overruns} overruns"
+            )
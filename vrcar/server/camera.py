@@ -1,58 +1,365 @@
 from __future__ import annotations
 
-import io
+import asyncio
+import concurrent.futures
+import contextlib
 import logging
-import multiprocessing
+import queue
 import socket
+import threading
+import time
+import typing
 
-import picamera2
-import picamera2.encoders
-import picamera2.outputs
+from vrcar.common import Frame, feedback_struct, frame_header_struct, recv_exact
+from vrcar.log import RateLimited
+from vrcar.server.frames import StreamingOutput
+from vrcar.server.quality import (
+    DEFAULT_PRESET,
+    PRESETS,
+    Preset,
+    QualityController,
+    tcp_rtt,
+)
+from vrcar.timeline import timeline
+
+if typing.TYPE_CHECKING:
+    from vrcar.video import VideoWriter
 
 logger = logging.getLogger(__name__)
+skip_logger = RateLimited(logger)
 
 
-class StreamingOutput(io.BufferedIOBase):
-    def __init__(self):
-        self.frame: bytes | None = None
-        self.condition = multiprocessing.Condition()
+class CameraClient(threading.Thread):
+    """Send frames to a single client without blocking the capture loop
 
-    def write(self, buf):
-        with self.condition:
-            self.frame = buf
-            self.condition.notify_all()
-        return len(buf)
+    Frames are queued in a bounded queue. If the client cannot keep up,
+    a keyframe replaces everything still queued while other frames are
+    dropped until the next keyframe, so inter-frame codecs stay decodable.
+    """
 
+    def __init__(
+        self,
+        client: socket.socket,
+        address: tuple[str, int],
+        size: int,
+        controller: QualityController | None = None,
+    ):
+        self._socket = client
+        self.address = address
+        self._queue: queue.Queue[Frame | None] = queue.Queue(size)
+        self._controller = controller
+        self.sent = 0
+        self.dropped = 0
+        self.total_dropped = 0
+        self.bytes_sent = 0
+        self.alive = True
+        # late joiners have to start with a keyframe
+        self.resync = True
+        # client send time and server receive time of the last feedback
+        self._echo: tuple[float, float] | None = None
+        super().__init__(daemon=True)
 
-def run(address: tuple[str, int]):
-    logger.info("Starting...")
-    stream = StreamingOutput()
-    picam2 = picamera2.Picamera2()
-    encoder = picamera2.encoders.MJPEGEncoder()
-    output = picamera2.outputs.FileOutput(stream)
+    def __str__(self):
+        return f"{self.address[0]}:{self.address[1]}"
 
-    picam2.configure(
-        picam2.create_video_configuration(
-            main={"size": (1024, 768)},
-            buffer_count=2,
-        )
-    )
+    def _drop(self):
+        self.dropped += 1
+        self.total_dropped += 1
+
+    def put(self, frame: Frame | None):
+        keyframe = frame is None or frame.keyframe
+        if not keyframe and self.resync:
+            self._drop()
+            return
+
+        self.resync = False
+        while True:
+            try:
+                self._queue.put_nowait(frame)
+            except queue.Full:
+                pass
+            else:
+                return
+
+            if not keyframe:
+                self._drop()
+                self.resync = True
+                return
+
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            else:
+                self._drop()
+
+    def _read_feedback(self):
+        buffer = bytearray(feedback_struct.size)
+        view = memoryview(buffer)
+        reported_dropped = 0
+
+        with contextlib.suppress(OSError):
+            while recv_exact(self._socket, view):
+                received, skipped, decode_time, sent = feedback_struct.unpack(buffer)
+                self._echo = sent, time.time()
+                dropped = self.total_dropped - reported_dropped
+                reported_dropped += dropped
+                if self._controller is None:
+                    continue
+
+                self._controller.report(
+                    str(self),
+                    received,
+                    skipped,
+                    decode_time,
+                    tcp_rtt(self._socket),
+                    dropped,
+                )
+
+    def run(self):
+        threading.Thread(target=self._read_feedback, daemon=True).start()
+        try:
+            while frame := self._queue.get():
+                echo, self._echo = self._echo, None
+                header = frame_header_struct.pack(
+                    len(frame.data),
+                    frame.sequence,
+                    frame.timestamp,
+                    time.time(),
+                    *(echo or (0.0, 0.0)),
+                )
+                self._send(header, frame.data)
+                self.sent += 1
+                if not timeline.reported:
+                    timeline.mark("first frame sent")
+                    timeline.report()
+        except OSError as error:
+            logger.info(f"Client {self} disconnected: {error}")
+        finally:
+            self.alive = False
+            self._socket.close()
+
+    def _send(self, *buffers: bytes | memoryview):
+        total = sum(map(len, buffers))
+        sent = self._socket.sendmsg(buffers)
+        self.bytes_sent += sent
+
+        if sent < total:
+            # rare partial write, fall back to sending the remainder
+            remainder = b"".join(buffers)[sent:]
+            self._socket.sendall(remainder)
+            self.bytes_sent += len(remainder)
+
+
+class Broadcaster:
+    """Fan frames out to any number of camera clients and an optional writer
+
+    New clients get the last published frame right away, so a running
+    camera does not make them wait for the next one.
+    """
+
+    STATS_INTERVAL = 10
+
+    def __init__(
+        self,
+        queue_size: int = 2,
+        controller: QualityController | None = None,
+        writer: VideoWriter | None = None,
+    ):
+        self._queue_size = queue_size
+        self._controller = controller
+        self._writer = writer
+        self._clients: list[CameraClient] = []
+        self._clients_lock = threading.Lock()
+        self._last: Frame | None = None
+        self.connected = asyncio.Event()
+        self._last_stats = time.monotonic()
+
+    async def accept(self, server: socket.socket):
+        """Accept clients on the non-blocking listening socket `server`"""
+        loop = asyncio.get_running_loop()
+        while True:
+            client, address = await loop.sock_accept(server)
+            logger.info(f"Accepted connection from {address[0]}:{address[1]}")
+            # each client has its own sender thread using blocking sends
+            client.setblocking(True)
+            sender = CameraClient(client, address, self._queue_size, self._controller)
+            sender.start()
+            with self._clients_lock:
+                # under the lock, so the next published frame follows it
+                if self._last is not None:
+                    sender.put(self._last)
+                self._clients.append(sender)
+            self.connected.set()
+
+    def publish(self, frame: Frame):
+        with self._clients_lock:
+            self._clients = [client for client in self._clients if client.alive]
+            clients = self._clients
+            self._last = frame
+
+        for client in clients:
+            client.put(frame)
+        if self._writer is not None:
+            self._writer.put(frame)
+
+        now = time.monotonic()
+        if now - self._last_stats >= self.STATS_INTERVAL:
+            elapsed = now - self._last_stats
+            self._last_stats = now
+            self.log_stats(clients, elapsed)
+            if self._writer is not None:
+                writer = self._writer
+                logger.info(
+                    f"Recording: {writer.written} written, {writer.dropped} dropped"
+                )
+
+    @staticmethod
+    def log_stats(clients: list[CameraClient], elapsed: float):
+        for client in clients:
+            logger.info(
+                f"Client {client}: {client.sent} sent, {client.dropped} dropped,"
+                f" {client.bytes_sent / elapsed / 1e6:.2f} MB/s"
+            )
+            client.sent = client.dropped = client.bytes_sent = 0
 
+    def resync(self):
+        with self._clients_lock:
+            for client in self._clients:
+                client.resync = True
+        if self._writer is not None:
+            self._writer.resync = True
+
+
+def create_source(
+    stream: StreamingOutput, codec: str, simulate: bool = False, bitrate: int = 0
+):
+    """Create the frame source, importing camera libraries only when needed"""
+    if simulate:
+        from vrcar.server.simulate import SyntheticSource
+
+        return SyntheticSource(stream, codec, bitrate)
+
+    from vrcar.server.picamera import PicameraSource
+
+    return PicameraSource(stream, codec)
+
+
+def _pump(
+    stream: StreamingOutput,
+    source: typing.Any,
+    broadcaster: Broadcaster,
+    controller: QualityController | None,
+    stopped: threading.Event,
+):
+    """Publish frames from `stream` until `stopped` is set"""
+    source.start()
+    timeline.mark("camera started")
+    try:
+        sequence = 0
+        while not stopped.is_set():
+            frame = stream.wait_for_newer(sequence, 1.0)
+            if frame is None:
+                continue
+            timeline.mark("first frame captured")
+            newest = frame.sequence
+
+            # publish every frame in order, inter-frame codecs depend on them
+            start = max(sequence + 1, newest - stream.slots + 1)
+            if start > sequence + 1:
+                skip_logger.warning(f"Skipped {start - sequence - 1} frames")
+                broadcaster.resync()
+
+            for sequence in range(start, newest + 1):
+                if frame := stream.get(sequence):
+                    broadcaster.publish(frame)
+
+            if controller and (preset := controller.poll()):
+                source.stop()
+                source.configure(preset)
+                source.start()
+    finally:
+        source.stop()
+
+
+def _close_writer(writer: VideoWriter | None):
+    if writer is not None:
+        writer.close()
+
+
+async def serve(
+    address: tuple[str, int],
+    codec: str = "mjpeg",
+    adaptive: bool = False,
+    simulate: bool = False,
+    preset: Preset | None = None,
+    bitrate: int = 0,
+    record: str | None = None,
+    warm: bool = False,
+):
+    """Serve camera frames on `address` until cancelled
+
+    `preset` overrides the initial quality preset. If `simulate` is set,
+    synthetic frames of roughly `bitrate` bits per second are served
+    instead of using the camera. The camera starts with the first client,
+    or right away if `warm` is set, and keeps running between sessions,
+    so reconnecting clients get frames right away. With `record`, the
+    served frames are also written to that file.
+    """
+    logger.info(f"Starting with {codec} encoder...")
+    loop = asyncio.get_running_loop()
+
+    # listen before the camera is ready, early clients wait for frames
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    logger.info("Awaiting connection")
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.setblocking(False)
     server.bind(address)
     server.listen()
+    timeline.mark("camera listening")
+    logger.info("Awaiting connections")
+
+    controller = QualityController() if adaptive else None
+    if preset is None:
+        preset = controller.preset if controller else PRESETS[DEFAULT_PRESET]
 
-    client, incoming_address = server.accept()
-    logger.info(f"Accepted connection from {incoming_address[0]}:{incoming_address[1]}")
-    picam2.start_recording(encoder, output)
+    writer = None
+    if record is not None:
+        from vrcar.video import VideoWriter
+
+        writer = VideoWriter(record)
+        writer.start()
+        logger.info(f"Recording video to {record}")
+
+    broadcaster = Broadcaster(controller=controller, writer=writer)
+    accept = asyncio.ensure_future(broadcaster.accept(server))
+    # camera calls block, so they get their own thread
+    executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="camera")
+    stopped = threading.Event()
+    try:
+        stream = StreamingOutput()
+        source = await loop.run_in_executor(
+            executor, create_source, stream, codec, simulate, bitrate
+        )
+        logger.info(f"Using quality preset {preset.name}")
+        await loop.run_in_executor(executor, source.configure, preset)
+        timeline.mark("camera ready")
+
+        if not warm:
+            await broadcaster.connected.wait()
+        await loop.run_in_executor(
+            executor, _pump, stream, source, broadcaster, controller, stopped
+        )
+    finally:
+        stopped.set()
+        accept.cancel()
+        server.close()
+        # the pump may still be publishing, so close the writer after it
+        executor.submit(_close_writer, writer)
+        executor.shutdown(wait=False)
 
-    while True:
-        with stream.condition:
-            stream.condition.wait()
-            frame = stream.frame
 
-        if frame:
-            length = len(frame).to_bytes(4, "big")
-            client.send(length)
-            client.send(frame)
+def run(address: tuple[str, int], *args, **kwargs):
+    try:
+        asyncio.run(serve(address, *args, **kwargs))
+    except Exception:
+        logger.exception("Unexpected error")
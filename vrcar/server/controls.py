@@ -1,56 +1,313 @@
 from __future__ import annotations
 
+import asyncio
+import functools
 import logging
-import socket
+import typing
 
-from vrcar.common import Commands, float_struct
-from vrcar.server.motors import Motors
-from vrcar.server.servos import Servos
+from vrcar.common import (
+    FRAME_ACK,
+    FRAME_HANDSHAKE,
+    Commands,
+    ack_struct,
+    float_struct,
+    frame_struct,
+)
+from vrcar.log import RateLimited
+from vrcar.server.actuators import Actuators
+from vrcar.server.pwm import PCA9685
+from vrcar.telemetry import Recorder
+from vrcar.timeline import timeline
+
+if typing.TYPE_CHECKING:
+    from collections.abc import Callable
+
+    from vrcar.server.motors import MotorConfig
 
 logger = logging.getLogger(__name__)
+stale_logger = RateLimited(logger)
+
+READ_SIZE = 64 * 1024
+
+
+def _apply_frame(
+    frame: tuple, actuators: Actuators, send: Callable[[bytes], typing.Any]
+):
+    sequence, timestamp, move, strafe, turn, head_h, head_v, flags = frame
+    # acknowledge only after the actuators have been updated
+    ack = ack_struct.pack(sequence, timestamp) if flags & FRAME_ACK else None
+    actuators.update(move, strafe, turn, head_h, head_v, ack, send, sequence, flags)
+
+
+_DRIVE_COMMANDS = {
+    Commands.MOVE.value[0]: 0,
+    Commands.STRAFE.value[0]: 1,
+    Commands.TURN.value[0]: 2,
+}
+_HEAD_COMMANDS = {Commands.HEAD_H.value[0]: 0, Commands.HEAD_V.value[0]: 1}
+
+
+class StreamProtocol(asyncio.BufferedProtocol):
+    """Update the actuators from a TCP session
+
+    Data is received straight into a preallocated buffer and unpacked in
+    place. The first byte selects the state frame protocol, anything else
+    is the first command of the legacy protocol. The actuators are stopped
+    once the last session of `sessions` ends.
+    """
+
+    def __init__(self, actuators: Actuators, sessions: set[StreamProtocol]):
+        self._actuators = actuators
+        self._sessions = sessions
+        self._transport: asyncio.Transport | None = None
+        self._buffer = bytearray(READ_SIZE)
+        self._view = memoryview(self._buffer)
+        # unprocessed bytes at the front of the buffer
+        self._length = 0
+        self._frames: bool | None = None
+        self._drive = [0.0, 0.0, 0.0]
+        self._peer = ""
+        self._send: Callable[[bytes], typing.Any] | None = None
+
+    def connection_made(self, transport):
+        self._transport = transport
+        host, port = transport.get_extra_info("peername")[:2]
+        self._peer = f"{host}:{port}"
+        logger.info(f"Accepted connection from {self._peer}")
+        # acks are sent from the actuator thread
+        loop = asyncio.get_running_loop()
+        self._send = functools.partial(loop.call_soon_threadsafe, self._write)
+        self._sessions.add(self)
+
+    def _write(self, data: bytes):
+        if self._transport is not None and not self._transport.is_closing():
+            self._transport.write(data)
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        return self._view[self._length :]
+
+    def buffer_updated(self, nbytes: int):
+        end = self._length + nbytes
+        position = 0
+        if self._frames is None:
+            self._frames = self._buffer[0] == FRAME_HANDSHAKE[0]
+            if self._frames:
+                logger.info("Using state frame protocol")
+                position = 1
+            else:
+                logger.info("Using legacy command protocol")
+
+        if self._frames:
+            position = self._read_frames(position, end)
+        else:
+            position = self._read_commands(position, end)
+
+        # move an incomplete frame or command to the front
+        self._length = end - position
+        if self._length:
+            self._view[: self._length] = self._view[position:end]
+
+    def _read_frames(self, position: int, end: int) -> int:
+        size = frame_struct.size
+        while end - position >= size:
+            frame = frame_struct.unpack_from(self._buffer, position)
+            _apply_frame(frame, self._actuators, self._send)
+            position += size
+
+        return position
+
+    def _read_commands(self, position: int, end: int) -> int:
+        buffer = self._buffer
+        drive = self._drive
+        while position < end:
+            cmd = buffer[position]
+            if cmd in _DRIVE_COMMANDS:
+                if end - position < 1 + float_struct.size:
+                    break
+                drive[_DRIVE_COMMANDS[cmd]] = float_struct.unpack_from(
+                    buffer, position + 1
+                )[0]
+                self._actuators.drive(*drive)
+                position += 1 + float_struct.size
+            else:
+                if end - position < 2:
+                    break
+                if cmd in _HEAD_COMMANDS:
+                    self._actuators.head(_HEAD_COMMANDS[cmd], buffer[position + 1])
+                position += 2
+
+        return position
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
 
+    def connection_lost(self, exc: Exception | None):
+        self._sessions.discard(self)
+        # do not keep driving once the last client is gone
+        if not self._sessions:
+            self._actuators.stop()
 
-def _run(address: tuple[str, int]):
+        pwm = PCA9685.shared()
+        logger.info(
+            f"Connection from {self._peer} closed,"
+            f" PWM register cache: {pwm.hits} hits, {pwm.misses} misses"
+        )
+
+
+class DatagramProtocol(asyncio.DatagramProtocol):
+    """Update the actuators from state frames of any number of UDP peers
+
+    Stale and reordered frames are dropped per peer. Each peer has its own
+    failsafe timer. If the peer whose frame was applied last sends nothing
+    within `timeout`, the motors are stopped, whatever other peers send.
+    """
+
+    def __init__(self, actuators: Actuators, timeout: float):
+        self._actuators = actuators
+        self._timeout = timeout
+        self._transport: asyncio.DatagramTransport | None = None
+        # last sequence per peer, so several senders do not drop each other
+        self._last_sequences: dict[tuple[str, int], int] = {}
+        self._failsafes: dict[tuple[str, int], asyncio.TimerHandle] = {}
+        # the peer whose frame was applied last
+        self._driver: tuple[str, int] | None = None
+        self._senders: dict[tuple[str, int], Callable[[bytes], typing.Any]] = {}
+        self.dropped = 0
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def datagram_received(self, data: bytes, address: tuple[str, int]):
+        if len(data) != frame_struct.size:
+            return
+
+        frame = frame_struct.unpack(data)
+        sequence = frame[0]
+        last_sequence = self._last_sequences.get(address)
+        if last_sequence is None:
+            logger.info(f"Receiving controls from {address[0]}:{address[1]}")
+
+        # serial number arithmetic, so the sequence may wrap around
+        elif (sequence - last_sequence) & 0xFFFF_FFFF >= 0x8000_0000 or (
+            sequence == last_sequence
+        ):
+            self.dropped += 1
+            stale_logger.debug(
+                f"Dropped stale packet {sequence} ({self.dropped} total)"
+            )
+            return
+
+        self._last_sequences[address] = sequence
+        failsafe = self._failsafes.get(address)
+        if failsafe is not None:
+            failsafe.cancel()
+        self._failsafes[address] = asyncio.get_running_loop().call_later(
+            self._timeout, self._expire, address
+        )
+        self._driver = address
+
+        send = self._senders.get(address)
+        if send is None:
+            loop = asyncio.get_running_loop()
+            send = self._senders[address] = functools.partial(
+                loop.call_soon_threadsafe, self._send, address
+            )
+        _apply_frame(frame, self._actuators, send)
+
+    def _send(self, address: tuple[str, int], data: bytes):
+        if self._transport is not None and not self._transport.is_closing():
+            self._transport.sendto(data, address)
+
+    def _expire(self, address: tuple[str, int]):
+        del self._failsafes[address]
+        # sequences are kept, so late datagrams cannot drive the motors again
+        self._senders.pop(address, None)
+        if address != self._driver:
+            logger.info(f"No controls from {address[0]}:{address[1]}")
+            return
+
+        logger.warning(
+            f"No controls received from {address[0]}:{address[1]}"
+            f" for {self._timeout * 1000:.0f}ms, stopping"
+        )
+        self._driver = None
+        self._actuators.stop()
+
+
+def _close(actuators: Actuators, recorder: Recorder | None):
+    actuators.close()
+    if recorder is not None:
+        recorder.close()
+
+
+async def _wait_ready(actuators: Actuators):
+    await asyncio.get_running_loop().run_in_executor(None, actuators.ready.wait)
+    if actuators.error is not None:
+        raise actuators.error
+    timeline.mark("actuators ready")
+
+
+async def serve(
+    address: tuple[str, int],
+    udp: bool = False,
+    timeout: float = 0.5,
+    rate: float = 100.0,
+    slew_rate: float = 300.0,
+    motor_config: MotorConfig | None = None,
+    record: str | None = None,
+):
+    """Serve controls until cancelled, accepting any number of sessions
+
+    The hardware is initialized once and kept across sessions, while
+    already listening for clients. With `record`, the session is recorded
+    to that file for `vrcar replay`.
+    """
     logger.info("Starting...")
-    motors = Motors()
-    servos = Servos()
-
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    logger.info("Awaiting connection")
-    server.bind(address)
-    server.listen()
-
-    client, incoming_address = server.accept()
-    logger.info(f"Accepted connection from {incoming_address[0]}:{incoming_address[1]}")
-
-    move = 0.0
-    strafe = 0.0
-    turn = 0.0
-    while cmd := client.recv(1):
-        if cmd in (Commands.MOVE.value, Commands.STRAFE.value, Commands.TURN.value):
-            data = float_struct.unpack(client.recv(4))[0]
-            if cmd == Commands.MOVE.value:
-                move = data
-                motors.move(move, strafe, turn)
-
-            elif cmd == Commands.STRAFE.value:
-                strafe = data
-                motors.move(move, strafe, turn)
-
-            elif cmd == Commands.TURN.value:
-                turn = data
-                motors.move(move, strafe, turn)
+    loop = asyncio.get_running_loop()
+    recorder = None
+    if record is not None:
+        recorder = Recorder(record)
+        recorder.start()
+        logger.info(f"Recording controls to {record}")
+
+    actuators = Actuators(rate, slew_rate, motor_config, recorder)
+    actuators.start()
+    try:
+        if udp:
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda: DatagramProtocol(actuators, timeout), local_addr=address
+            )
+            timeline.mark("controls listening")
+            logger.info("Awaiting datagrams")
+            try:
+                await _wait_ready(actuators)
+                await loop.create_future()
+            finally:
+                transport.close()
+
         else:
-            data = client.recv(1)[0]
-            if cmd == Commands.HEAD_H.value:
-                servos.set(0, data)
+            sessions: set[StreamProtocol] = set()
+            server = await loop.create_server(
+                lambda: StreamProtocol(actuators, sessions), *address
+            )
+            timeline.mark("controls listening")
+            logger.info("Awaiting connections")
+            try:
+                async with server:
+                    await _wait_ready(actuators)
+                    await server.serve_forever()
+            finally:
+                for session in list(sessions):
+                    session.close()
 
-            elif cmd == Commands.HEAD_V.value:
-                servos.set(1, data)
+    finally:
+        # a single call, which runs to completion even if cancelled again
+        await loop.run_in_executor(None, _close, actuators, recorder)
 
 
-def run(address: tuple[str, int]):
+def run(address: tuple[str, int], *args, **kwargs):
     try:
-        _run(address)
+        asyncio.run(serve(address, *args, **kwargs))
     except Exception:
         logger.exception("Unexpected error")
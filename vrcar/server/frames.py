@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import io
+import threading
+import time
+
+from vrcar.common import Frame
+
+
+class StreamingOutput(io.BufferedIOBase):
+    """Latest-frame store handing frames from the encoder to consumers
+
+    Each written frame gets a monotonically increasing sequence number and
+    is kept in a small ring of slots as a `memoryview` of the encoder's
+    buffer, so frames are never copied on their way to the socket. The
+    ring keeps a frame alive while slower consumers may still be sending it.
+    """
+
+    def __init__(self, slots: int = 4):
+        self.slots = slots
+        self._slots: list[Frame | None] = [None] * slots
+        self._condition = threading.Condition()
+        self.sequence = 0
+
+    def writable(self):
+        return True
+
+    def write(self, buf, keyframe: bool = True, timestamp: float | None = None):
+        view = memoryview(buf).cast("B")
+        if timestamp is None:
+            timestamp = time.time()
+
+        with self._condition:
+            sequence = self.sequence + 1
+            self._slots[sequence % self.slots] = Frame(
+                view, sequence, keyframe, timestamp
+            )
+            self.sequence = sequence
+            self._condition.notify_all()
+
+        return len(view)
+
+    def latest(self) -> Frame | None:
+        with self._condition:
+            return self._slots[self.sequence % self.slots]
+
+    def get(self, sequence: int) -> Frame | None:
+        """Get frame `sequence`, or `None` if it has already been overwritten"""
+        with self._condition:
+            if not self.sequence - self.slots < sequence <= self.sequence:
+                return None
+
+            return self._slots[sequence % self.slots]
+
+    def wait_for_newer(
+        self, sequence: int, timeout: float | None = None
+    ) -> Frame | None:
+        """Wait for a frame newer than `sequence` and return the newest one
+
+        Returns `None` if the timeout expired before a newer frame was written.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.sequence > sequence, timeout):
+                return None
+
+            return self._slots[self.sequence % self.slots]
@@ -1,52 +1,151 @@
 from __future__ import annotations
 
-import statistics
+import json
+import typing
 
 from vrcar.server.pwm import PCA9685
 
 # from PCA9685 import PCA9685
 
 
-class Motors:
-    def __init__(self):
-        self._pwm = PCA9685()
-        self._max = self._pwm.RESOLUTION - 1
+class MotorConfig(typing.NamedTuple):
+    # one row per wheel, mixing drive, strafe and turn into its speed
+    matrix: tuple[tuple[float, float, float], ...] = (
+        (1.0, 1.0, 1.0),
+        (1.0, -1.0, 1.0),
+        (1.0, -1.0, -1.0),
+        (1.0, 1.0, -1.0),
+    )
+    # per wheel speed factor, negative values invert the wheel
+    trim: tuple[float, ...] = (1.0, 1.0, 1.0, 1.0)
+    deadzone: float = 0.3
+    # evenly spaced points mapping speed magnitudes from 0 to 1, if any
+    curve: tuple[float, ...] | None = None
+
+
+def load_config(path: str) -> MotorConfig:
+    """Load a `MotorConfig` from a JSON file, missing keys use the defaults"""
+    with open(path, encoding="utf8") as file:
+        data = json.load(file)
+
+    config = MotorConfig()
+    return MotorConfig(
+        matrix=tuple(map(tuple, data.get("matrix", config.matrix))),
+        trim=tuple(data.get("trim", config.trim)),
+        deadzone=data.get("deadzone", config.deadzone),
+        curve=tuple(data["curve"]) if data.get("curve") else None,
+    )
+
 
+class Motors:
     MOTOR_CHANNELS = (
         (0, 1),
         (3, 2),
         (6, 7),
         (4, 5),
     )
+    # the motor channels are contiguous, so they can be written in one go
+    FIRST_CHANNEL = 0
+    CHANNEL_COUNT = 8
 
-    DEADZONE = 0.3
+    CURVE_SIZE = 256
 
-    def move(self, drive: float = 0.0, strafe: float = 0.0, turn: float = 0.0):
-        values = []
-
-        if abs(drive) > self.DEADZONE:
-            values.append((drive, drive, drive, drive))
-
-        if abs(strafe) > self.DEADZONE:
-            values.append((strafe, -strafe, -strafe, strafe))
-
-        if abs(turn) > self.DEADZONE:
-            values.append((turn, turn, -turn, -turn))
-
-        if not values:
-            values.append((0, 0, 0, 0))
+    def __init__(self, bus: typing.Any = None, config: MotorConfig | None = None):
+        self._pwm = PCA9685.shared(bus)
+        self._max = self._pwm.RESOLUTION - 1
 
-        for (a, b), duties in zip(self.MOTOR_CHANNELS, zip(*values)):
-            duty = int(min(max(-1.0, statistics.fmean(duties)), 1.0) * self._max)
+        if config is None:
+            config = MotorConfig()
+        if len(config.matrix) != len(self.MOTOR_CHANNELS) or len(config.trim) != len(
+            self.MOTOR_CHANNELS
+        ):
+            raise ValueError(f"Expected {len(self.MOTOR_CHANNELS)} wheels")
+
+        self.deadzone = config.deadzone
+        # trims are folded into the matrix, normalising afterwards keeps them
+        self._matrix = tuple(
+            (trim * a, trim * b, trim * c)
+            for (a, b, c), trim in zip(config.matrix, config.trim)
+        )
+        self._curve = self._build_curve(config.curve) if config.curve else None
+        self._wheels = tuple(zip(self.MOTOR_CHANNELS, range(len(self._matrix))))
+        self._speeds = [0.0] * len(self._matrix)
+        self._channels = [(0, 0)] * self.CHANNEL_COUNT
+
+    @classmethod
+    def _build_curve(cls, points: tuple[float, ...]) -> list[float]:
+        """Interpolate `points` into a lookup table of `CURVE_SIZE` entries"""
+        if len(points) < 2:
+            raise ValueError("A response curve needs at least two points")
+
+        segments = len(points) - 1
+        table = []
+        for index in range(cls.CURVE_SIZE):
+            position = index / (cls.CURVE_SIZE - 1) * segments
+            segment = min(int(position), segments - 1)
+            fraction = position - segment
+            start, end = points[segment], points[segment + 1]
+            table.append(start + (end - start) * fraction)
+
+        return table
+
+    def mix(
+        self, drive: float = 0.0, strafe: float = 0.0, turn: float = 0.0
+    ) -> tuple[tuple[int, int], ...]:
+        """Compute the `(on, off)` values of all motor channels"""
+        deadzone = self.deadzone
+        if -deadzone <= drive <= deadzone:
+            drive = 0.0
+        if -deadzone <= strafe <= deadzone:
+            strafe = 0.0
+        if -deadzone <= turn <= deadzone:
+            turn = 0.0
+
+        # scale down all wheels together if one exceeds full speed
+        speeds = self._speeds
+        peak = 1.0
+        for index, (a, b, c) in enumerate(self._matrix):
+            speed = a * drive + b * strafe + c * turn
+            speeds[index] = speed
+            if speed > peak:
+                peak = speed
+            elif -speed > peak:
+                peak = -speed
+
+        scale = self._max / peak
+        curve = self._curve
+        last = self.CURVE_SIZE - 1
+        maximum = self._max
+        channels = self._channels
+        for (a, b), index in self._wheels:
+            speed = speeds[index]
+            if speed == 0:
+                # brake, even if the curve starts above zero
+                duty = 0
+            elif curve is not None:
+                value = curve[int((speed if speed > 0 else -speed) / peak * last)]
+                duty = int(value * maximum if speed > 0 else -value * maximum)
+            else:
+                duty = int(speed * scale)
 
             if duty > 0:
-                self._pwm.set(a, 0, 0)
-                self._pwm.set(b, 0, duty)
+                channels[a] = (0, 0)
+                channels[b] = (0, duty)
 
             elif duty < 0:
-                self._pwm.set(a, 0, -duty)
-                self._pwm.set(b, 0, 0)
+                channels[a] = (0, -duty)
+                channels[b] = (0, 0)
 
             else:
-                self._pwm.set(a, 0, self._max)
-                self._pwm.set(b, 0, self._max)
+                channels[a] = (0, maximum)
+                channels[b] = (0, maximum)
+
+        # a snapshot, the list is reused by the next call
+        return tuple(channels)
+
+    def move(
+        self, drive: float = 0.0, strafe: float = 0.0, turn: float = 0.0
+    ) -> tuple[tuple[int, int], ...]:
+        channels = self.mix(drive, strafe, turn)
+        self._pwm.set_many(self.FIRST_CHANNEL, channels)
+        return channels
@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import time
+import typing
+
+import picamera2
+import picamera2.encoders
+import picamera2.outputs
+
+if typing.TYPE_CHECKING:
+    from vrcar.server.frames import StreamingOutput
+    from vrcar.server.quality import Preset
+
+H264_BITRATE = 4_000_000
+# keyframe interval, which bounds how long a late joiner has to wait
+H264_IPERIOD = 15
+
+
+class FrameOutput(picamera2.outputs.Output):
+    """Pass encoded frames and their keyframe flag to a `StreamingOutput`"""
+
+    def __init__(
+        self,
+        stream: StreamingOutput,
+        codec: str,
+        encoder: picamera2.encoders.Encoder,
+    ):
+        super().__init__()
+        self._stream = stream
+        self._encoder = encoder
+        # every JPEG decodes on its own, whatever flags the driver sets
+        self._intra_only = codec == "mjpeg"
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+        # the encoder passes the sensor timestamp in microseconds relative
+        # to its first frame, which resets with every start
+        first = getattr(self._encoder, "firsttimestamp", None)
+        captured = None
+        if timestamp is not None and first is not None:
+            # sensor timestamps use the boot time clock
+            age = time.clock_gettime(time.CLOCK_BOOTTIME) - (first + timestamp) / 1e6
+            captured = time.time() - age
+
+        self._stream.write(frame, keyframe or self._intra_only, captured)
+
+
+def create_encoder(codec: str) -> picamera2.encoders.Encoder:
+    if codec == "h264":
+        # baseline profile has no B-frames, and repeating the headers
+        # with every keyframe lets clients join mid-stream
+        return picamera2.encoders.H264Encoder(
+            bitrate=H264_BITRATE,
+            repeat=True,
+            iperiod=H264_IPERIOD,
+            profile="baseline",
+        )
+
+    return picamera2.encoders.MJPEGEncoder()
+
+
+class PicameraSource:
+    """Frame source using the Raspberry Pi camera and hardware encoders"""
+
+    def __init__(self, stream: StreamingOutput, codec: str):
+        self._picam2 = picamera2.Picamera2()
+        self._encoder = create_encoder(codec)
+        self._output = FrameOutput(stream, codec, self._encoder)
+        self._quality = picamera2.encoders.Quality.MEDIUM
+
+    def configure(self, preset: Preset):
+        self._picam2.configure(
+            self._picam2.create_video_configuration(
+                main={"size": preset.size},
+                controls={"FrameRate": preset.framerate},
+                buffer_count=2,
+            )
+        )
+        self._quality = picamera2.encoders.Quality[preset.quality]
+
+    def start(self):
+        self._picam2.start_recording(self._encoder, self._output, quality=self._quality)
+
+    def stop(self):
+        self._picam2.stop_recording()
@@ -1,8 +1,65 @@
 from __future__ import annotations
 
+import collections
+import threading
 import time
+import typing
 
-import smbus
+try:
+    import smbus
+except ImportError:
+    smbus: typing.Any
+
+
+class FakeSMBus:
+    """Hardware-free stand-in for `smbus.SMBus` counting I2C transactions
+
+    If `bitrate` is given, each transaction takes as long as it would on a
+    real bus of that speed. The last `history` writes are recorded along
+    with their time for inspection.
+    """
+
+    def __init__(self, bus: int = 1, bitrate: int = 0, history: int = 0):
+        self.bus = bus
+        self.bitrate = bitrate
+        self.transactions = 0
+        self.busy_time = 0.0
+        self.registers: dict[int, bytearray] = {}
+        self.history: collections.deque[tuple[float, int, int, bytes]] = (
+            collections.deque(maxlen=history)
+        )
+
+    def _registers(self, address: int) -> bytearray:
+        registers = self.registers.get(address)
+        if registers is None:
+            registers = self.registers[address] = bytearray(256)
+        return registers
+
+    def _transfer(self, length: int):
+        self.transactions += 1
+        if not self.bitrate:
+            return
+
+        # address, register and data bytes, each followed by an ack bit
+        duration = (length + 2) * 9 / self.bitrate
+        self.busy_time += duration
+        time.sleep(duration)
+
+    def _write(self, address: int, register: int, data: bytes):
+        self._transfer(len(data))
+        self._registers(address)[register : register + len(data)] = data
+        if self.history.maxlen:
+            self.history.append((time.monotonic(), address, register, data))
+
+    def write_byte_data(self, address: int, register: int, value: int):
+        self._write(address, register, bytes([value]))
+
+    def read_byte_data(self, address: int, register: int) -> int:
+        self._transfer(1)
+        return self._registers(address)[register]
+
+    def write_i2c_block_data(self, address: int, register: int, data: list[int]):
+        self._write(address, register, bytes(data))
 
 
 class PCA9685:
@@ -14,39 +71,140 @@ class PCA9685:
     PRE_SCALE = 0xFE
     # first pwm address (LED0_ON_L)
     PWM_ADDRESS = 0x06
+    # pwm address for all channels at once (ALL_LED_ON_L)
+    ALL_PWM_ADDRESS = 0xFA
 
     RESTART = 0b1000_0000
+    AUTO_INCREMENT = 0b0010_0000
     SLEEP = 0b0001_0000
 
     RESOLUTION = 1 << 12
+    CHANNELS = 16
+    # maximum length of a single SMBus block write
+    BLOCK_SIZE = 32
+
+    # bus used if none is given, `None` opens I2C bus 1 of the Pi
+    default_bus: typing.ClassVar[typing.Any] = None
+
+    _shared: typing.ClassVar[dict[tuple[typing.Any, int], PCA9685]] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, bus: typing.Any = None, address: int = ADDRESS):
+        if bus is None:
+            bus = smbus.SMBus(1) if self.default_bus is None else self.default_bus
+        self._bus = bus
+        self.address = address
+        self._lock = threading.Lock()
 
-    def __init__(self):
-        self._bus = smbus.SMBus(1)
-        self.write(self.MODE1, 0x00)
+        # shadow copy of the device registers, `None` if unknown
+        self._shadow: list[int | None] = [None] * 256
+        self.hits = 0
+        self.misses = 0
+
+        # auto increment lets us write multiple registers in a single transaction
+        self.write(self.MODE1, self.AUTO_INCREMENT)
+
+    @classmethod
+    def shared(cls, bus: typing.Any = None, address: int = ADDRESS) -> PCA9685:
+        """Get the device for `address` on `bus`, creating it on first use
+
+        `bus` defaults to I2C bus 1, which is opened only once.
+        """
+        key = (1 if bus is None else bus, address)
+        with cls._shared_lock:
+            device = cls._shared.get(key)
+            if device is None:
+                device = cls._shared[key] = cls(bus, address)
+
+        return device
 
     def write(self, register, value):
-        self._bus.write_byte_data(self.ADDRESS, register, value & 0xFF)
+        value &= 0xFF
+        with self._lock:
+            self._bus.write_byte_data(self.address, register, value)
+            self._shadow[register] = value
+
+    def write_block(self, register, values):
+        """Write `values` starting at `register`, skipping unchanged bytes
+
+        Only the span between the first and last changed byte is written.
+        """
+        with self._lock:
+            shadow = self._shadow
+            first = last = -1
+            for index, value in enumerate(values):
+                if shadow[register + index] != value:
+                    if first < 0:
+                        first = index
+                    last = index
+
+            if first < 0:
+                self.hits += len(values)
+                return
+
+            changed = values[first : last + 1]
+            self.hits += len(values) - len(changed)
+            self.misses += len(changed)
+
+            start = register + first
+            for offset in range(0, len(changed), self.BLOCK_SIZE):
+                self._bus.write_i2c_block_data(
+                    self.address,
+                    start + offset,
+                    changed[offset : offset + self.BLOCK_SIZE],
+                )
+            shadow[start : start + len(changed)] = changed
 
     def read(self, register):
-        return self._bus.read_byte_data(self.ADDRESS, register)
+        with self._lock:
+            value = self._bus.read_byte_data(self.address, register)
+            self._shadow[register] = value
+
+        return value
 
     def set_prescale(self, frequency):
+        # see page 25 (using 25MHz clock)
+        prescale = round(25e6 / (self.RESOLUTION * frequency)) - 1
+        # the prescaler keeps its value across server restarts, which
+        # saves the oscillator restart below
+        if self.read(self.PRE_SCALE) == prescale:
+            return
+
         # see page 15
         mode = self.read(self.MODE1)
         self.write(self.MODE1, mode & (0xFF ^ self.RESTART) | self.SLEEP)
-
-        # see page 25 (using 25MHz clock)
-        prescale = round(25e6 / (self.RESOLUTION * frequency)) - 1
         self.write(self.PRE_SCALE, prescale)
 
         self.write(self.MODE1, mode)
         time.sleep(500e-6)
         self.write(self.MODE1, mode | self.RESTART)
 
-    def set(self, channel, on, off):
-        offset = self.PWM_ADDRESS + (channel << 2)
+    @staticmethod
+    def _pack(on, off):
+        return [on & 0xFF, (on >> 8) & 0xFF, off & 0xFF, (off >> 8) & 0xFF]
 
-        self.write(offset + 0, on)
-        self.write(offset + 1, on >> 8)
-        self.write(offset + 2, off)
-        self.write(offset + 3, off >> 8)
+    def set(self, channel, on, off):
+        self.write_block(self.PWM_ADDRESS + (channel << 2), self._pack(on, off))
+
+    def set_many(self, channel, values):
+        """Set a contiguous range of channels starting at `channel`
+
+        `values` is a sequence of `(on, off)` pairs; the channels are
+        written using as few block writes as possible.
+        """
+        data = []
+        for on, off in values:
+            data.extend(self._pack(on, off))
+
+        self.write_block(self.PWM_ADDRESS + (channel << 2), data)
+
+    def set_all(self, on, off):
+        data = self._pack(on, off)
+        self.write_block(self.ALL_PWM_ADDRESS, data)
+
+        with self._lock:
+            # the ALL_LED registers read back as zero but apply to every channel
+            self._shadow[self.ALL_PWM_ADDRESS : self.ALL_PWM_ADDRESS + 4] = [None] * 4
+            self._shadow[self.PWM_ADDRESS : self.PWM_ADDRESS + 4 * self.CHANNELS] = (
+                data * self.CHANNELS
+            )
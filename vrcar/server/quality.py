@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import logging
+import socket
+import struct
+import threading
+import time
+import typing
+
+logger = logging.getLogger(__name__)
+
+
+class Preset(typing.NamedTuple):
+    name: str
+    size: tuple[int, int]
+    framerate: int
+    # name of a `picamera2.encoders.Quality` member
+    quality: str
+
+
+PRESETS = (
+    Preset("low", (640, 480), 15, "LOW"),
+    Preset("medium", (800, 600), 24, "MEDIUM"),
+    Preset("high", (1024, 768), 30, "MEDIUM"),
+    Preset("max", (1024, 768), 30, "HIGH"),
+)
+DEFAULT_PRESET = 2
+
+_tcp_info_rtt = struct.Struct("I")
+# offset of `tcpi_rtt` in Linux' `struct tcp_info`
+_TCP_INFO_RTT_OFFSET = 68
+
+
+def tcp_rtt(sock: socket.socket) -> float | None:
+    """Get the kernel's smoothed round trip time estimate of `sock` in seconds"""
+    try:
+        info = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 104)
+    except (AttributeError, OSError):
+        return None
+
+    return _tcp_info_rtt.unpack_from(info, _TCP_INFO_RTT_OFFSET)[0] / 1e6
+
+
+class QualityController:
+    """Step through `PRESETS` to hold a target latency
+
+    Clients periodically report how many frames they received and skipped
+    and how long decoding took. A single bad report steps the quality down,
+    while stepping up requires several consecutive good reports from the
+    same client, so more clients do not step up faster.
+    """
+
+    HOLD_TIME = 2.0
+    STEP_UP_REPORTS = 5
+    MAX_SKIPPED_RATIO = 0.2
+
+    def __init__(self, target_latency: float = 0.15, preset: int = DEFAULT_PRESET):
+        self.target_latency = target_latency
+        self.index = preset
+        self.history: list[tuple[float, str, str, str]] = []
+        self._lock = threading.Lock()
+        self._pending: Preset | None = None
+        # consecutive good reports per client since the last step
+        self._good_reports: dict[str, int] = {}
+        self._last_switch = time.monotonic()
+
+    @property
+    def preset(self) -> Preset:
+        return PRESETS[self.index]
+
+    def report(
+        self,
+        client: str,
+        received: int,
+        skipped: int,
+        decode_time: float,
+        rtt: float | None,
+        dropped: int,
+    ):
+        preset = self.preset
+        frame_time = 1 / preset.framerate
+        latency = decode_time + (rtt or 0.0)
+        skipped_ratio = skipped / received if received else 0.0
+
+        reason = None
+        if dropped:
+            reason = f"{dropped} frames dropped on the server"
+        elif skipped_ratio > self.MAX_SKIPPED_RATIO:
+            reason = f"client skipped {skipped_ratio:.0%} of frames"
+        elif decode_time > frame_time:
+            reason = f"decode time {decode_time * 1000:.1f}ms"
+        elif latency > self.target_latency:
+            reason = f"latency {latency * 1000:.1f}ms"
+
+        logger.debug(
+            f"Client {client}: {received} received, {skipped} skipped,"
+            f" {decode_time * 1000:.1f}ms decode, {(rtt or 0.0) * 1000:.1f}ms rtt"
+        )
+
+        with self._lock:
+            if reason is not None:
+                self._good_reports.clear()
+                self._step(-1, reason)
+                return
+
+            healthy = latency < self.target_latency / 2 and not skipped
+            good = self._good_reports.get(client, 0) + 1 if healthy else 0
+            self._good_reports[client] = good
+            if good >= self.STEP_UP_REPORTS:
+                self._good_reports.clear()
+                self._step(1, f"{self.STEP_UP_REPORTS} good reports from {client}")
+
+    def _step(self, direction: int, reason: str):
+        now = time.monotonic()
+        index = self.index + direction
+        if not 0 <= index < len(PRESETS) or now - self._last_switch < self.HOLD_TIME:
+            return
+
+        previous = self.preset
+        self.index = index
+        self._last_switch = now
+        self._pending = self.preset
+        self.history.append((time.time(), previous.name, self.preset.name, reason))
+        logger.info(
+            f"Switching quality preset {previous.name} -> {self.preset.name}"
+            f" ({reason}, {len(self.history)} switches)"
+        )
+
+    def poll(self) -> Preset | None:
+        """Get the preset to switch to, if it changed since the last call"""
+        with self._lock:
+            preset, self._pending = self._pending, None
+
+        return preset
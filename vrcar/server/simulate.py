@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import io
+import logging
+import threading
+import time
+import typing
+
+if typing.TYPE_CHECKING:
+    from vrcar.server.frames import StreamingOutput
+    from vrcar.server.quality import Preset
+
+logger = logging.getLogger(__name__)
+
+# JPEG comment segments are ignored by decoders and used as padding
+_COMMENT = b"\xff\xfe"
+_MAX_SEGMENT = 0xFFFF
+
+
+def render_frames(size: tuple[int, int], count: int, quality: int) -> list[bytes]:
+    """Render `count` JPEG frames with a bar moving across a gradient"""
+    try:
+        from PIL import Image, ImageDraw
+    except ImportError:
+        raise RuntimeError("Simulating the camera requires Pillow") from None
+
+    width, height = size
+    background = Image.linear_gradient("L").resize(size).convert("RGB")
+    bar_width = max(width // 16, 1)
+
+    frames = []
+    for index in range(count):
+        image = background.copy()
+        draw = ImageDraw.Draw(image)
+        left = (width - bar_width) * index // max(count - 1, 1)
+        draw.rectangle((left, 0, left + bar_width, height), fill=(255, 255, 255))
+        draw.text((8, 8), f"{index:03}", fill=(255, 0, 0))
+
+        with io.BytesIO() as buffer:
+            image.save(buffer, "JPEG", quality=quality)
+            frames.append(buffer.getvalue())
+
+    return frames
+
+
+def pad_jpeg(frame: bytes, size: int) -> bytes:
+    """Pad `frame` to at least `size` bytes using comment segments"""
+    missing = size - len(frame)
+    if missing <= 0:
+        return frame
+
+    segments = []
+    while missing > 0:
+        # the segment length includes its own two bytes
+        length = min(max(missing - 2, 2), _MAX_SEGMENT)
+        segments.append(_COMMENT + length.to_bytes(2, "big") + bytes(length - 2))
+        missing -= length + 2
+
+    # insert right after the start of image marker
+    return frame[:2] + b"".join(segments) + frame[2:]
+
+
+class SyntheticSource:
+    """Frame source generating JPEG frames without a camera
+
+    Frames are rendered once per configuration and then written to the
+    stream at the preset frame rate. If `bitrate` is given, frames are
+    padded to reach it.
+    """
+
+    FRAMES = 30
+    QUALITIES: typing.ClassVar[dict[str, int]] = {
+        "VERY_LOW": 30,
+        "LOW": 50,
+        "MEDIUM": 70,
+        "HIGH": 85,
+        "VERY_HIGH": 95,
+    }
+
+    def __init__(self, stream: StreamingOutput, codec: str, bitrate: int = 0):
+        if codec != "mjpeg":
+            raise ValueError("The simulated camera only supports mjpeg")
+
+        self._stream = stream
+        self._bitrate = bitrate
+        self._frames: list[bytes] = []
+        self._framerate = 30
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def configure(self, preset: Preset):
+        frames = render_frames(preset.size, self.FRAMES, self.QUALITIES[preset.quality])
+        if self._bitrate:
+            size = self._bitrate // 8 // preset.framerate
+            frames = [pad_jpeg(frame, size) for frame in frames]
+
+        self._frames = frames
+        self._framerate = preset.framerate
+        average = sum(map(len, frames)) / len(frames)
+        logger.info(
+            f"Simulating {preset.size[0]}x{preset.size[1]} at {preset.framerate}fps,"
+            f" {average * 8 * preset.framerate / 1e6:.1f}Mbit/s"
+        )
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        frames = self._frames
+        interval = 1 / self._framerate
+        deadline = time.monotonic()
+        index = 0
+
+        while not self._stopped.is_set():
+            self._stream.write(frames[index % len(frames)], True, time.time())
+            index += 1
+
+            deadline += interval
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                self._stopped.wait(delay)
+            else:
+                # running behind, do not try to catch up
+                deadline = time.monotonic()
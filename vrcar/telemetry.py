@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import logging
+import mmap
+import queue
+import struct
+import threading
+import typing
+
+if typing.TYPE_CHECKING:
+    from collections.abc import Iterator
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"VRCT"
+VERSION = 1
+# magic, version, record size and record count, zero until closed cleanly
+header_struct = struct.Struct("<4sHHQ")
+# arrival time, sequence, kind, flags, move, strafe, turn, head_h, head_v,
+# and for outputs the PWM off values of the 8 motor and 2 servo channels
+record_struct = struct.Struct("<dIBBfff2B10H")
+
+COMMAND = 1
+OUTPUT = 2
+
+
+class Record(typing.NamedTuple):
+    timestamp: float
+    sequence: int
+    kind: int
+    flags: int
+    move: float
+    strafe: float
+    turn: float
+    head_h: int
+    head_v: int
+    duties: tuple[int, ...]
+
+
+class Recorder(threading.Thread):
+    """Append fixed size records to a preallocated, memory mapped file
+
+    Records are handed to a background thread through a queue, so
+    recording never blocks the caller on disk I/O. The file grows in
+    steps of `capacity` records and is trimmed when closed.
+    """
+
+    def __init__(self, path: str, capacity: int = 1 << 16):
+        self.path = path
+        self._step = capacity * record_struct.size
+        # kept open for the lifetime of the recorder thread
+        self._file = open(path, "w+b")  # noqa: SIM115
+        self._file.truncate(header_struct.size + self._step)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        # readable even if the recorder never gets closed
+        header_struct.pack_into(self._map, 0, MAGIC, VERSION, record_struct.size, 0)
+        self._queue: queue.SimpleQueue[tuple | None] = queue.SimpleQueue()
+        self.count = 0
+        super().__init__(name="recorder", daemon=True)
+
+    def command(
+        self,
+        timestamp: float,
+        sequence: int,
+        flags: int,
+        move: float,
+        strafe: float,
+        turn: float,
+        head_h: int,
+        head_v: int,
+    ):
+        self._queue.put(
+            (timestamp, sequence, COMMAND, flags, move, strafe, turn, head_h, head_v)
+        )
+
+    def output(self, timestamp: float, duties: list[int]):
+        self._queue.put((timestamp, 0, OUTPUT, 0, 0.0, 0.0, 0.0, 0, 0, *duties))
+
+    def run(self):
+        mapping = self._map
+        size = record_struct.size
+        offset = header_struct.size
+        padding = (0,) * 10
+
+        while (values := self._queue.get()) is not None:
+            if offset + size > len(mapping):
+                mapping.resize(len(mapping) + self._step)
+
+            if len(values) == 9:
+                values += padding
+            record_struct.pack_into(mapping, offset, *values)
+            offset += size
+            self.count += 1
+
+        header_struct.pack_into(mapping, 0, MAGIC, VERSION, size, self.count)
+        mapping.resize(offset)
+        mapping.close()
+        self._file.close()
+
+    def close(self):
+        self._queue.put(None)
+        self.join()
+        logger.info(f"Recorded {self.count} records to {self.path}")
+
+
+class Recording:
+    """Read records from a file written by `Recorder` using a memory map"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, size, count = header_struct.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION or size != record_struct.size:
+            raise ValueError(f"{path} is not a supported telemetry recording")
+
+        available = (len(self._map) - header_struct.size) // size
+        # the count is only written on close, otherwise stop at the first gap
+        self.count = count or self._find_end(available)
+
+    def _find_end(self, available: int) -> int:
+        for index in range(available):
+            if not self._map[self._offset(index) + 12]:
+                return index
+        return available
+
+    @staticmethod
+    def _offset(index: int) -> int:
+        return header_struct.size + index * record_struct.size
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index: int) -> Record:
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+
+        values = record_struct.unpack_from(self._map, self._offset(index))
+        return Record(*values[:9], values[9:])
+
+    def __iter__(self) -> Iterator[Record]:
+        unpack = record_struct.unpack_from
+        for offset in range(
+            self._offset(0), self._offset(self.count), record_struct.size
+        ):
+            values = unpack(self._map, offset)
+            yield Record(*values[:9], values[9:])
+
+    def close(self):
+        self._map.close()
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+import typing
+
+if typing.TYPE_CHECKING:
+    from collections.abc import Callable
+
+logger = logging.getLogger(__name__)
+
+
+def _clock_and_start() -> tuple[Callable[[], float], float]:
+    """Get a clock and the time the process started according to it
+
+    On Linux the start time is read from `/proc`, so the timeline includes
+    interpreter startup and imports. Elsewhere it starts on first import.
+    """
+    try:
+        with open("/proc/self/stat", encoding="utf8") as file:
+            stat = file.read()
+        # fields are counted after the command name, which may contain spaces
+        ticks = int(stat.rsplit(")", 1)[1].split()[19])
+        clock_id = time.CLOCK_BOOTTIME
+    except (AttributeError, OSError, IndexError, ValueError):
+        return time.monotonic, time.monotonic()
+
+    return (
+        lambda: time.clock_gettime(clock_id),
+        ticks / os.sysconf("SC_CLK_TCK"),
+    )
+
+
+class Timeline:
+    """Startup milestones relative to the process start, logged once"""
+
+    def __init__(self):
+        self._clock, self.start = _clock_and_start()
+        self._marks: dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.reported = False
+
+    def mark(self, name: str):
+        """Record `name` as reached now, unless it was reached before"""
+        now = self._clock()
+        with self._lock:
+            self._marks.setdefault(name, now)
+
+    def report(self):
+        with self._lock:
+            if self.reported:
+                return
+            self.reported = True
+            marks = sorted(self._marks.items(), key=lambda item: item[1])
+
+        logger.info(
+            "Startup timeline: process start"
+            + "".join(
+                f" → {name} +{(reached - self.start) * 1000:.0f}ms"
+                for name, reached in marks
+            )
+        )
+
+
+timeline = Timeline()
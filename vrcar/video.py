@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import bisect
+import logging
+import mmap
+import os
+import queue
+import struct
+import threading
+import typing
+
+from vrcar.common import Frame
+
+if typing.TYPE_CHECKING:
+    from collections.abc import Iterator
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"VRCV"
+VERSION = 1
+# magic, version, entry size and entry count, zero until closed cleanly
+header_struct = struct.Struct("<4sHHQ")
+# data offset, length, sequence, capture timestamp and keyframe flag
+entry_struct = struct.Struct("<QIId?")
+
+
+def index_path(path: str) -> str:
+    return f"{path}.idx"
+
+
+class VideoWriter(threading.Thread):
+    """Write frames to `path` and an index of them to `path`.idx
+
+    The data file is the concatenation of the encoded frames. Frames are
+    handed to a background thread through a bounded queue. If the disk
+    cannot keep up, frames are dropped instead of blocking the caller,
+    followed by every frame up to the next keyframe, so inter-frame codecs
+    stay decodable.
+    """
+
+    def __init__(self, path: str, queue_size: int = 16):
+        self.path = path
+        self._queue: queue.Queue[Frame | None] = queue.Queue(queue_size)
+        self.written = 0
+        self.dropped = 0
+        self.bytes_written = 0
+        self.resync = True
+        super().__init__(name="video-writer", daemon=True)
+
+    def put(self, frame: Frame):
+        if self.resync and not frame.keyframe:
+            self.dropped += 1
+            return
+
+        if self._queue.full():
+            self.dropped += 1
+            self.resync = True
+            return
+
+        self.resync = False
+        self._queue.put_nowait(frame)
+
+    def run(self):
+        with open(self.path, "wb") as data, open(index_path(self.path), "wb") as index:
+            index.write(header_struct.pack(MAGIC, VERSION, entry_struct.size, 0))
+            offset = 0
+            while (frame := self._queue.get()) is not None:
+                length = data.write(frame.data)
+                index.write(
+                    entry_struct.pack(
+                        offset, length, frame.sequence, frame.timestamp, frame.keyframe
+                    )
+                )
+                offset += length
+                self.written += 1
+                self.bytes_written += length
+
+            index.seek(0)
+            index.write(
+                header_struct.pack(MAGIC, VERSION, entry_struct.size, self.written)
+            )
+
+    def close(self):
+        self._queue.put(None)
+        self.join()
+        logger.info(
+            f"Recorded {self.written} frames ({self.bytes_written / 1e6:.1f} MB)"
+            f" to {self.path}, {self.dropped} dropped"
+        )
+
+
+class VideoRecording:
+    """Read frames of a file written by `VideoWriter` using memory maps"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as data, open(index_path(path), "rb") as index:
+            if not os.fstat(data.fileno()).st_size:
+                raise ValueError(f"{path} contains no frames")
+            self._data = mmap.mmap(data.fileno(), 0, access=mmap.ACCESS_READ)
+            self._index = mmap.mmap(index.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, size, count = header_struct.unpack_from(self._index)
+        if magic != MAGIC or version != VERSION or size != entry_struct.size:
+            raise ValueError(f"{path} is not a supported video recording")
+
+        # the count is only written on close, otherwise use complete entries
+        self.count = count or (len(self._index) - header_struct.size) // size
+
+    def __len__(self):
+        return self.count
+
+    def _entry(self, index: int) -> tuple[int, int, int, float, bool]:
+        return entry_struct.unpack_from(
+            self._index, header_struct.size + index * entry_struct.size
+        )
+
+    def timestamp(self, index: int) -> float:
+        return self._entry(index)[3]
+
+    def __getitem__(self, index: int) -> Frame:
+        """Get frame `index`, its data is a view into the memory map"""
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+
+        offset, length, sequence, timestamp, keyframe = self._entry(index)
+        data = memoryview(self._data)[offset : offset + length]
+        return Frame(data, sequence, keyframe, timestamp)
+
+    def __iter__(self) -> Iterator[Frame]:
+        return map(self.__getitem__, range(self.count))
+
+    def seek(self, timestamp: float) -> int:
+        """Get the index of the keyframe to decode from to show `timestamp`
+
+        The frame shown at `timestamp` is found by binary search over the
+        index, then the search goes back to the keyframe it depends on.
+        """
+        index = bisect.bisect_right(range(self.count), timestamp, key=self.timestamp)
+        index = max(index - 1, 0)
+        while index > 0 and not self._entry(index)[4]:
+            index -= 1
+        return index
+
+    def close(self):
+        """Close the memory maps, views of frames have to be released first"""
+        self._data.close()
+        self._index.close()